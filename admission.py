@@ -0,0 +1,257 @@
+"""Per-user ordering and admission control for request handlers.
+
+Every request that changes a user's state runs in that user's lane. A lane
+runs one request at a time, in arrival order, so a user's turns never race
+on their session or profile. Requests for different users only share a
+lock for the few instructions it takes to pick the next one.
+
+At most ``max_active`` requests run at once. Others wait in their user's
+lane. When a slot frees, lanes take turns round-robin, one request each, so
+a user with a burst of requests waits behind everyone else's next turn
+instead of ahead of it. The wait is bounded in three ways. At most
+``max_queued`` requests wait in total. At most ``max_queued_per_user``
+wait per user. No request waits longer than ``queue_timeout`` seconds.
+Beyond any of these, ``Overloaded`` is raised, which the app turns into a
+429 with a ``Retry-After`` estimated from recent service times.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import jsonify
+
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server busy ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("counted", "event", "enqueued_at", "admitted")
+
+    def __init__(self, counted):
+        self.counted = counted
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.admitted = False
+
+
+def _noop():
+    pass
+
+
+class AdmissionController:
+    """Per-user FIFO lanes sharing a bounded number of active slots.
+
+    ``acquire`` returns a release callable. Pass ``counted=False`` for work
+    that runs inside a request that already holds a slot, such as the
+    per-user groups of a batch: it keeps its place in the user's lane
+    but does not take another slot or count against the queue limits.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_active = 16
+        self.max_queued = 256
+        self.max_queued_per_user = 8
+        self.queue_timeout = 30.0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "user_queue_full": 0, "timeout": 0}
+        self._lock = threading.Lock()
+        self._lanes = {}
+        # Users with waiters and no request running, in round-robin order.
+        self._ready = deque()
+        self._busy = set()
+        self._active = 0
+        self._queued = 0
+        # Moving average of how long an admitted request holds its slot.
+        self._service_seconds = 0.1
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the admission limits and registers the 429 error handler."""
+        self.enabled = app.config.get("ADMISSION_ENABLED", self.enabled)
+        self.max_active = int(app.config.get("ADMISSION_MAX_ACTIVE", self.max_active))
+        self.max_queued = int(app.config.get("ADMISSION_MAX_QUEUED", self.max_queued))
+        self.max_queued_per_user = int(app.config.get("ADMISSION_MAX_QUEUED_PER_USER", self.max_queued_per_user))
+        self.queue_timeout = float(app.config.get("ADMISSION_QUEUE_TIMEOUT", self.queue_timeout))
+
+        @app.errorhandler(Overloaded)
+        def overloaded(exc):
+            response = jsonify({"error": str(exc), "reason": exc.reason})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(exc.retry_after)
+            return response
+
+    def acquire(self, user_id, counted=True):
+        """Waits for the user's turn; returns a callable that ends it.
+
+        A ``user_id`` of None is not ordered against anything and only
+        needs a slot.
+        """
+        if not self.enabled:
+            return _noop
+        lane = user_id if user_id is not None else object()
+        with self._lock:
+            if self._can_run(lane, counted):
+                # Fast path: nothing to wait for.
+                self._start(lane, counted)
+                return self._releaser(lane, counted)
+            waiter = self._enqueue(lane, counted)
+        self._wait(lane, waiter)
+        return self._releaser(lane, counted)
+
+    def try_acquire(self, user_id, counted=True):
+        """Like ``acquire``, but returns None instead of waiting."""
+        if not self.enabled:
+            return _noop
+        lane = user_id if user_id is not None else object()
+        with self._lock:
+            if not self._can_run(lane, counted):
+                return None
+            self._start(lane, counted)
+        return self._releaser(lane, counted)
+
+    async def acquire_async(self, user_id, counted=False):
+        """``acquire`` for coroutines; waits on an executor thread only when it must."""
+        release = self.try_acquire(user_id, counted)
+        if release is None:
+            release = await asyncio.get_running_loop().run_in_executor(None, self.acquire, user_id, counted)
+        return release
+
+    @contextmanager
+    def slot(self, user_id):
+        """Runs the block as the user's next turn."""
+        release = self.acquire(user_id)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self):
+        """Returns queue depth, active requests and admission counters."""
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": self._queued,
+                "waiting_users": len(self._lanes),
+                "max_active": self.max_active,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "average_service_seconds": round(self._service_seconds, 4),
+            }
+
+    def _releaser(self, lane, counted):
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._finish(lane, counted, time.monotonic() - started)
+
+        return release
+
+    def _finish(self, lane, counted, seconds):
+        with self._lock:
+            self._busy.discard(lane)
+            if counted:
+                self._active -= 1
+                self._service_seconds += 0.1 * (seconds - self._service_seconds)
+            if lane in self._lanes:
+                # Back of the line: every other waiting user goes first.
+                self._ready.append(lane)
+            self._dispatch()
+
+    def _wait(self, lane, waiter):
+        if waiter.event.wait(self.queue_timeout):
+            return
+        with self._lock:
+            if waiter.admitted:
+                # Admitted just as the wait timed out.
+                return
+            waiters = self._lanes[lane]
+            waiters.remove(waiter)
+            if not waiters:
+                del self._lanes[lane]
+                if lane in self._ready:
+                    self._ready.remove(lane)
+            if waiter.counted:
+                self._queued -= 1
+            self._reject("timeout")
+
+    # The methods below are called with self._lock held.
+
+    def _can_run(self, lane, counted):
+        if lane in self._busy or lane in self._lanes:
+            return False
+        return not counted or (self._active < self.max_active and not self._queued)
+
+    def _start(self, lane, counted):
+        self._busy.add(lane)
+        if counted:
+            self._active += 1
+            self.admitted += 1
+
+    def _enqueue(self, lane, counted):
+        waiters = self._lanes.get(lane)
+        if counted:
+            if self._queued >= self.max_queued:
+                self._reject("queue_full")
+            if waiters is not None and len(waiters) >= self.max_queued_per_user:
+                self._reject("user_queue_full")
+            self._queued += 1
+        waiter = _Waiter(counted)
+        if waiters is None:
+            waiters = self._lanes[lane] = deque()
+            if lane not in self._busy:
+                self._ready.append(lane)
+        waiters.append(waiter)
+        self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        """Starts waiting requests, one per lane per round, while slots are free."""
+        skipped = 0
+        while skipped < len(self._ready):
+            lane = self._ready[0]
+            waiters = self._lanes[lane]
+            waiter = waiters[0]
+            if waiter.counted and self._active >= self.max_active:
+                # Only uncounted work can start; look at the next lane.
+                self._ready.rotate(-1)
+                skipped += 1
+                continue
+            self._ready.popleft()
+            waiters.popleft()
+            if not waiters:
+                del self._lanes[lane]
+            if waiter.counted:
+                self._queued -= 1
+                metrics.observe_admission_wait(time.monotonic() - waiter.enqueued_at)
+            self._start(lane, waiter.counted)
+            waiter.admitted = True
+            waiter.event.set()
+            skipped = 0
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        backlog = self._queued + self._active
+        retry_after = math.ceil(self._service_seconds * backlog / max(self.max_active, 1))
+        raise Overloaded(reason, min(max(retry_after, 1), 60))
+
+
+# Shared controller, configured with the app like the SQLAlchemy instance.
+admission = AdmissionController()
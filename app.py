@@ -1,44 +1,239 @@
-from flask import Flask, request, jsonify, render_template_string
+import time
+# Measured before anything else is imported; reported by create_app().
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, stream_with_context
 from flask_cors import CORS
+import asyncio
+import atexit
+import gc
 import json
 import uuid
-from database import db, create_user, get_user, update_user
+from admission import Overloaded, admission
+from assets import assets
+from conversation_store import ConversationStore
+from database import db
+from feedback_log import FEEDBACK_SCORES, FeedbackLog
+from embedding_index import EmbeddingIndex, HashingEmbedder, numpy_available
+from llm_backends import create_backend
 from memory_manager import MemoryManager
+from metrics import metrics
+from migrations import migrate_schema
+from profile_store import ProfileStore
+from profile_transfer import export_profiles, import_profiles
+from session_cache import SessionCache
+from session_store import append_exchanges, clear_exchanges, create_session_store
+from storage import engine_options, init_storage
+from tone_compiler import DEFAULT_TONE, tone_compiler
 from tone_engine import ToneEngine
+from trace_log import logger, trace_log
 import os
 
-app = Flask(__name__)
-# Enable Cross-Origin Resource Sharing
-CORS(app)
-
-# --- SQLAlchemy Configuration ---
-project_dir = os.path.dirname(os.path.abspath(__file__))
-database_file = f"sqlite:///{os.path.join(project_dir, 'tone_system.db')}"
-app.config["SQLALCHEMY_DATABASE_URI"] = database_file
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize the database with the app
-db.init_app(app)
-
-# --- Create Database Tables ---
-@app.before_request
-def create_tables():
-    # Use before_request instead of before_first_request which is deprecated
-    # This function will run once before the first request
-    if not hasattr(app, 'tables_created'):
-        db.create_all()
-        app.tables_created = True
-
-
-# In-memory storage for session-based memory
-user_memory_managers = {}
-
-def get_memory_manager(user_id):
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+bp = Blueprint("tone", __name__)
+
+def load_config(app, overrides=None):
+    """Reads the settings from the environment; ``overrides`` take precedence."""
+    # --- SQLAlchemy Configuration ---
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    database_file = f"sqlite:///{os.path.join(project_dir, 'tone_system.db')}"
+    # DATABASE_URL may point at a server database instead of the local SQLite file.
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", database_file)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Optional separate database (e.g. a replica) for read-only endpoints.
+    app.config["DATABASE_READ_URL"] = os.environ.get("DATABASE_READ_URL")
+
+    # --- Storage Engine ---
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", "10"))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+    app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # Negative values are in KiB, so the default is a 64 MiB page cache per connection.
+    app.config["SQLITE_CACHE_SIZE"] = int(os.environ.get("SQLITE_CACHE_SIZE", "-65536"))
+    app.config["SQLITE_CACHED_STATEMENTS"] = int(os.environ.get("SQLITE_CACHED_STATEMENTS", "256"))
+
+    # --- Profile Persistence ---
+    # "immediate" commits every interaction; "batched" coalesces dirty profiles
+    # in memory and flushes them together in the background.
+    app.config["PROFILE_WRITE_MODE"] = os.environ.get("PROFILE_WRITE_MODE", "immediate")
+    app.config["PROFILE_FLUSH_INTERVAL"] = float(os.environ.get("PROFILE_FLUSH_INTERVAL", "1.0"))
+    app.config["PROFILE_FLUSH_MAX_PENDING"] = int(os.environ.get("PROFILE_FLUSH_MAX_PENDING", "256"))
+
+    # --- Shared Sessions ---
+    # "memory" keeps sessions in each worker process. "sqlite" (SESSION_STORE_PATH, e.g. on /dev/shm)
+    # or "redis" (SESSION_STORE_URL) share them between workers, with per-user versioned writes.
+    app.config["SESSION_STORE"] = os.environ.get("SESSION_STORE", "memory")
+    app.config["SESSION_STORE_PATH"] = os.environ.get("SESSION_STORE_PATH", "/dev/shm/tone_sessions.db")
+    app.config["SESSION_STORE_URL"] = os.environ.get("SESSION_STORE_URL", "redis://127.0.0.1:6379/0")
+
+    # --- Conversation Log ---
+    # Exchanges are appended to the database in batches; new sessions reload only the newest turns.
+    app.config["CONVERSATION_STORE_ENABLED"] = os.environ.get("CONVERSATION_STORE_ENABLED", "1") not in ("0", "false", "False")
+    app.config["CONVERSATION_FLUSH_INTERVAL"] = float(os.environ.get("CONVERSATION_FLUSH_INTERVAL", "1.0"))
+    app.config["CONVERSATION_FLUSH_MAX_PENDING"] = int(os.environ.get("CONVERSATION_FLUSH_MAX_PENDING", "500"))
+    app.config["CONVERSATION_HYDRATE_TURNS"] = int(os.environ.get("CONVERSATION_HYDRATE_TURNS", "20"))
+    # Turns beyond the newest CONVERSATION_COMPACT_KEEP are folded into a summary every interval (0 disables).
+    app.config["CONVERSATION_COMPACT_INTERVAL"] = float(os.environ.get("CONVERSATION_COMPACT_INTERVAL", "300"))
+    app.config["CONVERSATION_COMPACT_KEEP"] = int(os.environ.get("CONVERSATION_COMPACT_KEEP", "200"))
+
+    # --- Profile Cache ---
+    # LRU cache in front of profile reads (0 entries disables it). PROFILE_CACHE_TTL bounds the age of a cached
+    # profile; PROFILE_CACHE_VALIDATE checks users.version on every hit and should be on with several workers.
+    app.config["PROFILE_CACHE_MAX_ENTRIES"] = int(os.environ.get("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+    app.config["PROFILE_CACHE_TTL"] = float(os.environ.get("PROFILE_CACHE_TTL", "0"))
+    app.config["PROFILE_CACHE_VALIDATE"] = os.environ.get("PROFILE_CACHE_VALIDATE", "0") not in ("0", "false", "False")
+
+    # --- Session Cache ---
+    # Limits of 0 disable the corresponding bound.
+    app.config["SESSION_CACHE_MAX_ENTRIES"] = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "10000"))
+    app.config["SESSION_CACHE_MAX_BYTES"] = int(os.environ.get("SESSION_CACHE_MAX_BYTES", "0"))
+    # Per-session byte budget for stored exchanges; messages of at least SESSION_COMPRESS_MIN_CHARS are zlib-compressed.
+    app.config["SESSION_MAX_BYTES"] = int(os.environ.get("SESSION_MAX_BYTES", str(64 * 1024)))
+    app.config["SESSION_COMPRESS_MIN_CHARS"] = int(os.environ.get("SESSION_COMPRESS_MIN_CHARS", "0"))
+    app.config["SESSION_IDLE_TTL"] = float(os.environ.get("SESSION_IDLE_TTL", "3600"))
+
+    # --- Prompt Budget ---
+    # Oldest turns are trimmed once history would push a prompt past this size.
+    app.config["PROMPT_MAX_CHARS"] = int(os.environ.get("PROMPT_MAX_CHARS", "8000"))
+
+    # --- Conversation Recall ---
+    # Past exchanges are embedded locally (requires numpy) and the most similar older ones are added to prompts.
+    app.config["EMBEDDINGS_ENABLED"] = os.environ.get("EMBEDDINGS_ENABLED", "1") not in ("0", "false", "False")
+    app.config["EMBEDDING_DIM"] = int(os.environ.get("EMBEDDING_DIM", "256"))
+    # Directory for per-user memory-mapped indexes; unset keeps them in memory only.
+    app.config["EMBEDDING_DIR"] = os.environ.get("EMBEDDING_DIR")
+    # Older exchanges are dropped from a user's index once it holds this many (0 keeps all of them).
+    app.config["EMBEDDING_MAX_ROWS"] = int(os.environ.get("EMBEDDING_MAX_ROWS", "1000"))
+    app.config["RECALL_TOP_K"] = int(os.environ.get("RECALL_TOP_K", "3"))
+    app.config["RECALL_MIN_SCORE"] = float(os.environ.get("RECALL_MIN_SCORE", "0.2"))
+
+    # --- Tone Rules ---
+    # Optional JSON file of per-context tone overrides, merged over the built-in 'work' and 'personal' rules.
+    app.config["TONE_RULES_FILE"] = os.environ.get("TONE_RULES_FILE", os.path.join(app.root_path, "tone_rules.json"))
+
+    # --- Static Assets ---
+    # Files under STATIC_DIR are served from STATIC_URL_PREFIX with content-hash names, precompressed at startup.
+    app.config["STATIC_DIR"] = os.environ.get("STATIC_DIR", os.path.join(app.root_path, "static"))
+    app.config["STATIC_URL_PREFIX"] = os.environ.get("STATIC_URL_PREFIX", "/assets")
+    app.config["STATIC_MIN_COMPRESS_SIZE"] = int(os.environ.get("STATIC_MIN_COMPRESS_SIZE", "256"))
+
+    # --- LLM Backend ---
+    # "simulated" uses the built-in offline responses; "http" calls LLM_HTTP_URL.
+    app.config["LLM_BACKEND"] = os.environ.get("LLM_BACKEND", "simulated")
+    app.config["LLM_HTTP_URL"] = os.environ.get("LLM_HTTP_URL", "http://127.0.0.1:8089/generate")
+    app.config["LLM_TIMEOUT"] = float(os.environ.get("LLM_TIMEOUT", "30"))
+    app.config["LLM_MAX_CONCURRENCY"] = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+    app.config["LLM_MAX_RETRIES"] = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+    app.config["LLM_HEDGE_AFTER"] = float(os.environ["LLM_HEDGE_AFTER"]) if os.environ.get("LLM_HEDGE_AFTER") else None
+
+    # --- Batch Chat ---
+    # NDJSON batches are processed (one profile query, one commit) per chunk of this many items.
+    app.config["CHAT_BATCH_CHUNK_SIZE"] = int(os.environ.get("CHAT_BATCH_CHUNK_SIZE", "500"))
+
+    # --- Bulk Profile Import/Export ---
+    # Profiles are upserted in one transaction per chunk and exported in chunks of the same size.
+    app.config["PROFILE_IMPORT_CHUNK_SIZE"] = int(os.environ.get("PROFILE_IMPORT_CHUNK_SIZE", "1000"))
+
+    # --- Feedback Learning ---
+    # Feedback events are appended in batches; every FEEDBACK_AGGREGATE_INTERVAL seconds (0 disables it,
+    # e.g. when `python feedback_log.py aggregate` runs from cron) tone patterns are relearned from them.
+    app.config["FEEDBACK_FLUSH_INTERVAL"] = float(os.environ.get("FEEDBACK_FLUSH_INTERVAL", "1.0"))
+    app.config["FEEDBACK_FLUSH_MAX_PENDING"] = int(os.environ.get("FEEDBACK_FLUSH_MAX_PENDING", "1000"))
+    app.config["FEEDBACK_AGGREGATE_INTERVAL"] = float(os.environ.get("FEEDBACK_AGGREGATE_INTERVAL", "60"))
+    app.config["FEEDBACK_HALF_LIFE_DAYS"] = float(os.environ.get("FEEDBACK_HALF_LIFE_DAYS", "30"))
+    app.config["FEEDBACK_MIN_EVENTS"] = int(os.environ.get("FEEDBACK_MIN_EVENTS", "5"))
+    app.config["FEEDBACK_MIN_SUCCESS"] = float(os.environ.get("FEEDBACK_MIN_SUCCESS", "0.6"))
+    app.config["FEEDBACK_RETENTION_DAYS"] = float(os.environ.get("FEEDBACK_RETENTION_DAYS", "180"))
+
+    # --- Admission Control ---
+    # Each user's requests run one at a time, in order. At most ADMISSION_MAX_ACTIVE requests run at once and
+    # waiting users take turns; past the queue limits or ADMISSION_QUEUE_TIMEOUT seconds, requests get a 429.
+    app.config["ADMISSION_ENABLED"] = os.environ.get("ADMISSION_ENABLED", "1") not in ("0", "false", "False")
+    app.config["ADMISSION_MAX_ACTIVE"] = int(os.environ.get("ADMISSION_MAX_ACTIVE", "16"))
+    app.config["ADMISSION_MAX_QUEUED"] = int(os.environ.get("ADMISSION_MAX_QUEUED", "256"))
+    app.config["ADMISSION_MAX_QUEUED_PER_USER"] = int(os.environ.get("ADMISSION_MAX_QUEUED_PER_USER", "8"))
+    app.config["ADMISSION_QUEUE_TIMEOUT"] = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+    # --- Metrics ---
+    # Set METRICS_ENABLED=0 to remove all instrumentation and the /metrics route.
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False")
+
+    # --- Logging ---
+    # Events are sampled per kind ("prompt", "feedback", "tone_pattern") and written by a background thread.
+    app.config["LOG_SAMPLE_RATES"] = os.environ.get("LOG_SAMPLE_RATES", "prompt=0.01")
+    app.config["LOG_DEFAULT_SAMPLE_RATE"] = float(os.environ.get("LOG_DEFAULT_SAMPLE_RATE", "1.0"))
+    app.config["LOG_REDACT"] = os.environ.get("LOG_REDACT", "1") not in ("0", "false", "False")
+    app.config["LOG_MAX_FIELD_CHARS"] = int(os.environ.get("LOG_MAX_FIELD_CHARS", "2000"))
+    app.config["LOG_QUEUE_SIZE"] = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+    # Optional gzip trace of sampled prompts for offline replay; rotated by uncompressed size.
+    app.config["TRACE_FILE"] = os.environ.get("TRACE_FILE")
+    app.config["TRACE_FILE_MAX_BYTES"] = int(os.environ.get("TRACE_FILE_MAX_BYTES", str(64 * 1024 * 1024)))
+    app.config["TRACE_FILE_BACKUPS"] = int(os.environ.get("TRACE_FILE_BACKUPS", "5"))
+
+    # --- Startup ---
+    # Warm-up caches the profiles of the WARMUP_PROFILES most recently active users, with their tone tables.
+    app.config["WARMUP_ENABLED"] = os.environ.get("WARMUP_ENABLED", "1") not in ("0", "false", "False")
+    app.config["WARMUP_PROFILES"] = int(os.environ.get("WARMUP_PROFILES", "1000"))
+
+    app.config.update(overrides or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+
+# Components shared by the request handlers; create_app() initializes them once per process.
+profile_store = ProfileStore()
+conversation_store = ConversationStore()
+feedback_log = FeedbackLog()
+write_engine = read_engine = None
+session_store = None
+llm_backend = None
+embedder = None
+# In-memory storage for session-based memory, bounded by LRU and idle TTL.
+user_memory_managers = None
+_fork_handler_installed = False
+
+def get_memory_manager(user_id, user_profile=None):
     """Retrieves or creates a MemoryManager for a user."""
-    if user_id not in user_memory_managers:
-        user_profile = get_user(user_id)
-        user_memory_managers[user_id] = MemoryManager(user_id, user_profile)
-    return user_memory_managers[user_id]
+    def load():
+        profile = user_profile if user_profile is not None else profile_store.get(user_id)
+        index = None
+        if embedder is not None:
+            index = EmbeddingIndex(
+                user_id, embedder, directory=current_app.config["EMBEDDING_DIR"],
+                max_rows=current_app.config["EMBEDDING_MAX_ROWS"],
+            )
+        memory_manager = MemoryManager(
+            user_id, profile, max_history_chars=current_app.config["PROMPT_MAX_CHARS"],
+            embedding_index=index, recall_k=current_app.config["RECALL_TOP_K"],
+            recall_min_score=current_app.config["RECALL_MIN_SCORE"],
+            max_history_bytes=current_app.config["SESSION_MAX_BYTES"],
+            compress_min_chars=current_app.config["SESSION_COMPRESS_MIN_CHARS"],
+        )
+        memory_manager.hydrate(conversation_store.load_recent(user_id))
+        return memory_manager
+    memory_manager = user_memory_managers.get_or_create(user_id, load)
+    if user_profile is not None and memory_manager.profile is not user_profile:
+        # A reloaded profile may carry newly learned tone patterns.
+        memory_manager.set_profile(user_profile)
+    if session_store is not None:
+        state, version = session_store.load(user_id)
+        if state is not None and version != memory_manager.session_version:
+            memory_manager.restore(state, version)
+    return memory_manager
+
+def _update_shared_session(memory_manager, change):
+    """Writes a change to the shared session and reconciles the local copy.
+
+    If another worker wrote in between, the local copy is replaced by the
+    merged state from the store.
+    """
+    state, version = session_store.update(memory_manager.user_id, change)
+    if version == memory_manager.session_version + 1:
+        memory_manager.session_version = version
+    else:
+        memory_manager.restore(state, version)
 
 # --- MODIFIED: Updated HTML with new UI and fields ---
 INDEX_HTML = """
@@ -48,30 +243,8 @@ INDEX_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Adaptive Tone AI</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        body { font-family: 'Inter', sans-serif; background-color: #121212; }
-        .chat-bubble { max-width: 75%; padding: 0.75rem 1rem; border-radius: 1.25rem; word-wrap: break-word; line-height: 1.5; }
-        .chat-bubble.user { background-color: #6366f1; color: white; border-bottom-right-radius: 0.25rem; }
-        .chat-bubble.ai { background-color: #374151; color: #e5e7eb; border-bottom-left-radius: 0.25rem; }
-        ::-webkit-scrollbar { width: 8px; }
-        ::-webkit-scrollbar-track { background: #1f2937; }
-        ::-webkit-scrollbar-thumb { background: #4b5563; border-radius: 4px; }
-        ::-webkit-scrollbar-thumb:hover { background: #6b7280; }
-        .form-select {
-            background-image: url("data:image/svg+xml,%3csvg xmlns='http://www.w3.org/2000/svg' fill='none' viewBox='0 0 20 20'%3e%3cpath stroke='%239ca3af' stroke-linecap='round' stroke-linejoin='round' stroke-width='1.5' d='M6 8l4 4 4-4'/%3e%3c/svg%3e");
-            background-position: right 0.5rem center;
-            background-repeat: no-repeat;
-            background-size: 1.5em 1.5em;
-            padding-right: 2.5rem;
-            -webkit-appearance: none;
-            -moz-appearance: none;
-            appearance: none;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('vendor/tailwind.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
 <body class="text-gray-200 flex h-screen">
 
@@ -156,167 +329,334 @@ INDEX_HTML = """
         </div>
     </div>
 
-    <script>
-        const API_URL = 'http://127.0.0.1:5000';
-
-        async function createProfile() {
-            const userId = document.getElementById('user_id').value;
-            const formality = document.getElementById('formality').value;
-            const enthusiasm = document.getElementById('enthusiasm').value;
-            const verbosity = document.getElementById('verbosity').value;
-            // --- NEW: Get values from new dropdowns ---
-            const persona = document.getElementById('persona').value;
-            const humor = document.getElementById('humor').value;
-            const profileStatus = document.getElementById('profile_status');
-
-            if (!userId) {
-                profileStatus.textContent = 'User ID cannot be empty.';
-                profileStatus.className = 'text-sm text-center text-red-500 mt-3';
-                return;
-            }
-
-            const profileData = {
-                user_id: userId,
-                preferences: {
-                    // --- MODIFIED: Include new attributes in the payload ---
-                    tone_preferences: { formality, enthusiasm, verbosity, persona, humor },
-                    communication_style: { technical_level: "intermediate" }
-                }
-            };
-
-            try {
-                const response = await fetch(`${API_URL}/api/profile`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(profileData)
-                });
-                const result = await response.json();
-                profileStatus.textContent = result.message;
-                profileStatus.className = 'text-sm text-center text-green-500 mt-3';
-                
-                document.getElementById('message_input').disabled = false;
-                document.getElementById('send_button').disabled = false;
-                document.getElementById('welcome_message_container').innerHTML = '<p class="text-gray-500">You can now chat with the AI.</p>';
-            } catch (error) {
-                profileStatus.textContent = 'Error creating profile.';
-                profileStatus.className = 'text-sm text-center text-red-500 mt-3';
-                console.error('Profile creation error:', error);
-            }
-        }
-
-        async function sendMessage() {
-            const userId = document.getElementById('user_id').value;
-            const messageInput = document.getElementById('message_input');
-            const message = messageInput.value.trim();
-
-            if (!message || !userId) return;
-            
-            const welcomeMsg = document.getElementById('welcome_message_container');
-            if (welcomeMsg) welcomeMsg.remove();
-
-            addMessageToChat('user', message);
-            messageInput.value = '';
-            addMessageToChat('ai', '...', 'thinking-bubble'); // Typing indicator
-
-            try {
-                const response = await fetch(`${API_URL}/api/chat`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ user_id: userId, message: message, context: 'personal' })
-                });
-                
-                const thinkingBubble = document.getElementById('thinking-bubble');
-                if (thinkingBubble) thinkingBubble.remove();
-
-                const result = await response.json();
-                if (response.ok) {
-                    addMessageToChat('ai', result.response);
-                } else {
-                    addMessageToChat('ai', `Error: ${result.error}`);
-                }
-            } catch (error) {
-                const thinkingBubble = document.getElementById('thinking-bubble');
-                if (thinkingBubble) thinkingBubble.remove();
-                addMessageToChat('ai', 'An unexpected network error occurred.');
-                console.error('Chat error:', error);
-            }
-        }
-        
-        function addMessageToChat(role, text, id = null) {
-            const chatWindow = document.getElementById('chat_window');
-            const bubbleWrapper = document.createElement('div');
-            const alignment = role === 'user' ? 'justify-end' : 'justify-start';
-            const bubbleClasses = role === 'user' ? 'user' : 'ai';
-            
-            const wrapperDiv = document.createElement('div');
-            wrapperDiv.className = `flex w-full ${alignment}`;
-
-            bubbleWrapper.className = `chat-bubble ${bubbleClasses}`;
-            if (id) bubbleWrapper.id = id;
-            if (text === '...') bubbleWrapper.classList.add('animate-pulse');
-            
-            bubbleWrapper.textContent = text;
-            
-            wrapperDiv.appendChild(bubbleWrapper);
-            chatWindow.appendChild(wrapperDiv);
-            chatWindow.scrollTop = chatWindow.scrollHeight;
-        }
-
-        document.getElementById('message_input').addEventListener('keypress', function (e) {
-            if (e.key === 'Enter') {
-                sendMessage();
-            }
-        });
-    </script>
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>
 """
 
-@app.route('/')
+@bp.route('/')
 def index():
-    """Serves the main HTML page."""
-    return render_template_string(INDEX_HTML)
+    """Serves the main HTML page, compiled once at startup."""
+    return assets.serve_page("index")
 
 # --- API Endpoints ---
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Main conversation endpoint."""
-    data = request.json
+def _start_chat(data):
+    """Validates a chat request and loads what is needed to answer it.
+
+    Returns ``(turn, None)`` on success or ``(None, error_response)``.
+    """
     user_id = data.get('user_id')
     message = data.get('message')
     context = data.get('context', 'personal')
     feedback = data.get('feedback_on_previous')
 
     if not user_id or not message:
-        return jsonify({"error": "user_id and message are required"}), 400
+        return None, (jsonify({"error": "user_id and message are required"}), 400)
 
-    user_profile = get_user(user_id)
+    with metrics.span("get_user"):
+        user_profile = profile_store.get(user_id)
     if not user_profile:
-        return jsonify({"error": "User profile not found. Please create a profile first."}), 404
+        return None, (jsonify({"error": "User profile not found. Please create a profile first."}), 404)
 
-    memory_manager = get_memory_manager(user_id)
-    tone_engine = ToneEngine(user_profile, memory_manager)
+    with metrics.span("get_memory_manager"):
+        memory_manager = get_memory_manager(user_id, user_profile)
+    tone_engine = ToneEngine(user_profile, memory_manager, llm_backend)
 
     if feedback:
         tone_engine.process_feedback(feedback)
-        update_user(user_id, user_profile)
-
-    memory_manager.add_to_short_term_memory({"role": "user", "message": message})
-    response_text, applied_tone = tone_engine.generate_response(message, context)
-    memory_manager.add_to_short_term_memory({"role": "assistant", "message": response_text})
-    
-    update_user(user_id, user_profile) # Save interaction count
+        _log_feedback(memory_manager, feedback)
+
+    turn = {
+        "user_id": user_id,
+        "message": message,
+        "context": context,
+        "feedback": feedback,
+        "profile": user_profile,
+        "memory_manager": memory_manager,
+        "tone_engine": tone_engine,
+    }
+    return turn, None
+
+def _remember_exchange(memory_manager, message, response_text, context=None):
+    """Adds a completed exchange to short-term memory and the conversation log."""
+    # The prompt already ends with the new message, so record it after generating.
+    exchanges = [{"role": "user", "message": message}, {"role": "assistant", "message": response_text}]
+    prior = memory_manager.get_conversation_history().to_list() if session_store is not None else None
+    for exchange in exchanges:
+        memory_manager.add_to_short_term_memory(exchange, context)
+    if session_store is not None:
+        # A missing (new or expired) shared session is seeded from this worker's copy.
+        _update_shared_session(memory_manager, lambda state: append_exchanges(
+            state if "short_term_memory" in state else {"short_term_memory": prior},
+            exchanges, memory_manager.max_history_chars,
+        ))
+    conversation_store.append(memory_manager.user_id, exchanges, context)
+    user_memory_managers.refresh(memory_manager.user_id)
+
+def _log_feedback(memory_manager, feedback):
+    """Logs feedback on the tone of the user's previous response, if it was generated here."""
+    if feedback in FEEDBACK_SCORES and memory_manager.last_applied is not None:
+        context, tone = memory_manager.last_applied
+        feedback_log.record(memory_manager.user_id, feedback, context, tone)
+
+def _finish_chat(turn, response_text):
+    """Commits a completed exchange to memory and the user's profile."""
+    _remember_exchange(turn["memory_manager"], turn["message"], response_text, turn["context"])
+    with metrics.span("update_user"):
+        profile_store.record_interaction(turn["user_id"], turn["profile"], turn["feedback"]) # Save interaction count
+
+def _sse_event(event, data):
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/api/chat', methods=['POST'])
+def chat():
+    """Main conversation endpoint."""
+    data = request.json
+    with admission.slot(data.get('user_id')):
+        turn, error = _start_chat(data)
+        if error:
+            return error
+
+        tone_engine = turn["tone_engine"]
+        response_text, applied_tone = tone_engine.generate_response(turn["message"], turn["context"])
+        _finish_chat(turn, response_text)
     conversation_id = str(uuid.uuid4())
 
     return jsonify({
         "response": response_text,
         "tone_applied": applied_tone,
         "memory_updated": True,
+        "prompt_size": tone_engine.last_prompt_stats,
         "conversation_id": conversation_id
     })
 
-@app.route('/api/profile', methods=['POST'])
+@bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming conversation endpoint using server-sent events.
+
+    Emits a ``meta`` event with the applied tone, one ``token`` event per
+    response chunk, then ``done`` once memory has been updated. The
+    user's turn lasts until the stream is closed.
+    """
+    data = request.json
+    release = admission.acquire(data.get('user_id'))
+    try:
+        turn, error = _start_chat(data)
+        if error:
+            release()
+            return error
+
+        tone_engine = turn["tone_engine"]
+        chunks, applied_tone = tone_engine.stream_response(turn["message"], turn["context"])
+    except BaseException:
+        release()
+        raise
+    conversation_id = str(uuid.uuid4())
+
+    def events():
+        try:
+            yield _sse_event("meta", {
+                "tone_applied": applied_tone,
+                "prompt_size": tone_engine.last_prompt_stats,
+                "conversation_id": conversation_id
+            })
+            parts = []
+            try:
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield _sse_event("token", {"text": chunk})
+            except Exception as exc:
+                yield _sse_event("error", {"error": str(exc)})
+                return
+            _finish_chat(turn, "".join(parts))
+            yield _sse_event("done", {"memory_updated": True})
+        finally:
+            # The turn ends with the stream, even if the server never closes the response.
+            release()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+    # Covers streams that are closed before their first event.
+    response.call_on_close(release)
+    return response
+
+def _run_chat_batch(items, offset=0):
+    """Answers a list of chat items and returns one result per item, in order.
+
+    Profiles are loaded in one query, each user's items run in order while
+    different users are generated concurrently, and all profile updates are
+    saved together at the end. Each user's items wait for, and hold, that
+    user's turn, so they do not interleave with the user's other requests.
+    """
+    results = [None] * len(items)
+    groups = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('user_id') or not item.get('message'):
+            results[index] = {"index": offset + index, "error": "user_id and message are required"}
+        else:
+            groups.setdefault(item['user_id'], []).append(index)
+
+    with metrics.span("get_user"):
+        profiles = profile_store.get_many(list(groups))
+    interactions = []
+
+    async def run_user(user_id, indexes):
+        try:
+            release = await admission.acquire_async(user_id)
+        except Overloaded as exc:
+            for index in indexes:
+                results[index] = {"index": offset + index, "error": str(exc)}
+            return
+        try:
+            await run_user_items(user_id, indexes)
+        finally:
+            release()
+
+    async def run_user_items(user_id, indexes):
+        profile = profiles[user_id]
+        memory_manager = get_memory_manager(user_id, profile)
+        tone_engine = ToneEngine(profile, memory_manager, llm_backend)
+        for index in indexes:
+            item = items[index]
+            feedback = item.get('feedback_on_previous')
+            if feedback:
+                tone_engine.process_feedback(feedback)
+                _log_feedback(memory_manager, feedback)
+            try:
+                response_text, applied_tone = await tone_engine.agenerate_response(item['message'], item.get('context', 'personal'))
+            except Exception as exc:
+                results[index] = {"index": offset + index, "error": str(exc)}
+                continue
+            _remember_exchange(memory_manager, item['message'], response_text, item.get('context', 'personal'))
+            interactions.append((user_id, profile, feedback))
+            results[index] = {
+                "index": offset + index,
+                "user_id": user_id,
+                "response": response_text,
+                "tone_applied": applied_tone
+            }
+
+    async def run_all():
+        tasks = []
+        for user_id, indexes in groups.items():
+            if profiles.get(user_id) is None:
+                for index in indexes:
+                    results[index] = {"index": offset + index, "error": "User profile not found. Please create a profile first."}
+            else:
+                tasks.append(run_user(user_id, indexes))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run_all())
+    with metrics.span("update_user"):
+        profile_store.record_interactions(interactions)
+    return results
+
+def _iter_ndjson_chunks(stream, chunk_size):
+    """Reads NDJSON lines from a stream and yields lists of parsed items."""
+    chunk = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            chunk.append(json.loads(line))
+        except ValueError:
+            # Leave a placeholder so the item still gets an error result.
+            chunk.append(None)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+@bp.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Bulk conversation endpoint for offline jobs.
+
+    Accepts ``{"items": [...]}`` and returns ``{"results": [...]}``, or an
+    ``application/x-ndjson`` body of items, answered with one NDJSON result
+    line per item as each chunk completes. A batch takes one admission
+    slot for as long as it runs.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        chunk_size = current_app.config["CHAT_BATCH_CHUNK_SIZE"]
+
+        def lines():
+            try:
+                offset = 0
+                for chunk in _iter_ndjson_chunks(request.stream, chunk_size):
+                    for result in _run_chat_batch(chunk, offset):
+                        yield json.dumps(result) + "\n"
+                    offset += len(chunk)
+            finally:
+                # The batch ends with the stream, even if the server never closes the response.
+                release()
+
+        release = admission.acquire(None)
+        response = Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+        # Covers streams that are closed before their first line.
+        response.call_on_close(release)
+        return response
+
+    data = request.json
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "items must be a list"}), 400
+    with admission.slot(None):
+        return jsonify({"results": _run_chat_batch(items)})
+
+def _feedback_event(event):
+    """Validates one bulk feedback event; returns ``(event tuple, error)``."""
+    if not isinstance(event, dict) or not event.get('user_id'):
+        return None, "user_id is required"
+    if event.get('feedback') not in FEEDBACK_SCORES:
+        return None, f"feedback must be one of {sorted(FEEDBACK_SCORES)}"
+    context, tone = event.get('context'), event.get('tone')
+    if tone is None:
+        # Default to the tone of the user's last response, if this worker generated it.
+        memory_manager = user_memory_managers.peek(event['user_id'])
+        last_applied = memory_manager.last_applied if memory_manager is not None else None
+        if last_applied is None or context not in (None, last_applied[0]):
+            return None, "tone is required when the rated response was not generated by this server"
+        context, tone = last_applied
+    elif not isinstance(tone, dict):
+        return None, "tone must be an object"
+    return (event['user_id'], event['feedback'], context, tone), None
+
+@bp.route('/api/feedback', methods=['POST'])
+def feedback_ingest():
+    """Bulk feedback ingestion.
+
+    Accepts ``{"events": [{"user_id", "feedback", "context", "tone"}, ...]}``
+    or an ``application/x-ndjson`` body of events. Events are appended to the
+    feedback log; the aggregation job learns tone patterns from them.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        chunks = _iter_ndjson_chunks(request.stream, current_app.config["CHAT_BATCH_CHUNK_SIZE"])
+    else:
+        data = request.json
+        events = data.get('events') if isinstance(data, dict) else None
+        if not isinstance(events, list):
+            return jsonify({"error": "events must be a list"}), 400
+        chunks = [events]
+
+    accepted, errors, offset = 0, [], 0
+    for chunk in chunks:
+        valid = []
+        for index, event in enumerate(chunk, offset):
+            parsed, error = _feedback_event(event)
+            if error:
+                errors.append({"index": index, "error": error})
+            else:
+                valid.append(parsed)
+        feedback_log.record_many(valid)
+        accepted += len(valid)
+        offset += len(chunk)
+    return jsonify({"accepted": accepted, "errors": errors})
+
+@bp.route('/api/profile', methods=['POST'])
 def profile_create_update():
     """Create or update a user profile."""
     data = request.json
@@ -326,17 +666,23 @@ def profile_create_update():
     if not user_id or not preferences:
         return jsonify({"error": "user_id and preferences are required"}), 400
 
-    existing_user_profile = get_user(user_id)
+    with admission.slot(user_id):
+        return _save_profile(user_id, preferences)
+
+def _save_profile(user_id, preferences):
+    """Creates or updates a profile; runs as one of the user's turns."""
+    existing_user_profile = profile_store.get(user_id)
     
     # --- MODIFIED: More robust handling of preference updates ---
     if existing_user_profile:
         # Update preferences, keeping existing ones if new ones aren't provided
         existing_user_profile['tone_preferences'] = preferences.get('tone_preferences', existing_user_profile.get('tone_preferences', {}))
         existing_user_profile['communication_style'] = preferences.get('communication_style', existing_user_profile.get('communication_style', {}))
-        update_user(user_id, existing_user_profile)
+        profile_store.update(user_id, existing_user_profile)
         # Update the profile in the in-memory manager if it exists
-        if user_id in user_memory_managers:
-            user_memory_managers[user_id].profile = existing_user_profile
+        memory_manager = user_memory_managers.peek(user_id)
+        if memory_manager is not None:
+            memory_manager.set_profile(existing_user_profile)
         return jsonify({"message": f"Profile updated for {user_id}", "user_id": user_id})
     else:
         new_profile = {
@@ -350,38 +696,248 @@ def profile_create_update():
                 "last_interaction": None
             }
         }
-        create_user(new_profile)
+        profile_store.create(new_profile)
         return jsonify({"message": f"Profile created for {user_id}", "user_id": user_id}), 201
 
-
-@app.route('/api/profile/<user_id>', methods=['GET'])
+@bp.route('/api/profiles/import', methods=['POST'])
+def profiles_import():
+    """Bulk profile upsert from an NDJSON body, one profile per line.
+
+    Streams back NDJSON events: ``error`` per rejected line, ``progress``
+    per committed chunk and a final ``done`` with the totals.
+    """
+    def events():
+        for event in import_profiles(
+            write_engine, request.stream, current_app.config["PROFILE_IMPORT_CHUNK_SIZE"],
+            on_commit=lambda user_ids: [profile_store.invalidate(user_id) for user_id in user_ids],
+        ):
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson')
+
+@bp.route('/api/profiles/export', methods=['GET'])
+def profiles_export():
+    """Streams every profile as NDJSON, ordered by user_id."""
+    lines = export_profiles(read_engine, current_app.config["PROFILE_IMPORT_CHUNK_SIZE"])
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@bp.route('/api/profile/<user_id>', methods=['GET'])
 def profile_retrieve(user_id):
     """Retrieve a user profile."""
-    user = get_user(user_id)
+    user = profile_store.get(user_id, read_only=True)
     if user:
         return jsonify(user)
     return jsonify({"error": "User not found"}), 404
 
-@app.route('/api/memory/<user_id>', methods=['GET'])
+@bp.route('/api/memory/<user_id>', methods=['GET'])
 def memory_retrieve(user_id):
     """Get conversation memory for a user."""
-    memory_manager = get_memory_manager(user_id)
-    if memory_manager:
-        memory_data = {
-            "short_term_memory": list(memory_manager.short_term_memory),
-            "long_term_summary": "Long-term summary not yet implemented in this version."
-        }
-        return jsonify(memory_data)
-    return jsonify({"error": "Memory not found for user"}), 404
-
-@app.route('/api/memory/<user_id>', methods=['DELETE'])
+    # Unknown ids get no session, so lookups cannot fill the cache or the embedding directory.
+    user_profile = profile_store.get(user_id)
+    if not user_profile:
+        return jsonify({"error": "Memory not found for user"}), 404
+    memory_manager = get_memory_manager(user_id, user_profile)
+    memory_data = {
+        "short_term_memory": memory_manager.get_conversation_history().to_list(),
+        "long_term_summary": conversation_store.summary(user_id) or "No earlier conversation has been summarized yet."
+    }
+    return jsonify(memory_data)
+
+@bp.route('/api/sessions/stats', methods=['GET'])
+def session_stats():
+    """Report session cache counters for capacity planning."""
+    return jsonify(user_memory_managers.stats())
+
+@bp.route('/api/profiles/cache/stats', methods=['GET'])
+def profile_cache_stats():
+    """Report profile cache counters."""
+    return jsonify(profile_store.cache_stats())
+
+@bp.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    """Report admission queue depth and rejections."""
+    return jsonify(admission.stats())
+
+@bp.route('/api/sessions/<user_id>/footprint', methods=['GET'])
+def session_footprint(user_id):
+    """Report the approximate memory held by one user's session."""
+    memory_manager = user_memory_managers.peek(user_id)
+    if memory_manager is None:
+        return jsonify({"error": "No active session for user"}), 404
+    return jsonify(memory_manager.footprint())
+
+@bp.route('/api/memory/<user_id>', methods=['DELETE'])
 def memory_clear(user_id):
     """Clear user memory."""
-    if user_id in user_memory_managers:
-        user_memory_managers[user_id].clear_short_term_memory()
+    with admission.slot(user_id):
+        _clear_memory(user_id)
     return jsonify({"message": f"Short-term memory cleared for user_id: {user_id}"})
 
-if __name__ == '__main__':
+def _clear_memory(user_id):
+    """Forgets the user's conversation here, in the shared session and in the recall index."""
+    memory_manager = user_memory_managers.peek(user_id)
+    if memory_manager is not None:
+        memory_manager.forget()
+        if session_store is not None:
+            _update_shared_session(memory_manager, clear_exchanges)
+        user_memory_managers.refresh(user_id)
+    else:
+        if session_store is not None:
+            session_store.update(user_id, clear_exchanges)
+        EmbeddingIndex.remove_files(user_id, current_app.config["EMBEDDING_DIR"])
+    conversation_store.mark_cleared(user_id)
+
+# --- Application Factory ---
+def init_schema(app):
+    """Creates missing tables and migrates the schema; runs once at startup."""
     with app.app_context():
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+        migrate_schema(db.engine)
+
+def warm_up(app):
+    """Loads what the first requests would otherwise load; returns the number of profiles cached.
+
+    Caches the profiles of the most recently active users, compiles their
+    tone tables and lets the LLM backend prepare for their tones. Everything
+    allocated so far is then frozen out of the garbage collector (``gc.freeze``), so
+    forked workers do not write to those pages during collections and keep
+    sharing them copy-on-write. Warm-up starts no background threads.
+    """
+    with app.app_context():
+        profiles = profile_store.preload(app.config["WARMUP_PROFILES"])
+    tones = []
+    for profile in profiles:
+        tones.extend(tone_compiler.table_for(profile.get('tone_preferences', DEFAULT_TONE)).values())
+    llm_backend.warm_up(tones)
+    gc.collect()
+    gc.freeze()
+    return len(profiles)
+
+def _after_fork_in_child():
+    """Drops connections a forked worker inherited from the parent process."""
+    for engine in {write_engine, read_engine} - {None}:
+        engine.dispose(close=False)
+    if session_store is not None:
+        session_store.forget_connections()
+
+def _register_gauges():
+    metrics.gauge("tone_active_sessions", "Chat sessions held in memory.", lambda: len(user_memory_managers))
+    metrics.gauge("tone_session_bytes", "Approximate memory held by chat sessions.", lambda: user_memory_managers.stats()["bytes"])
+    metrics.gauge(
+        "tone_session_cache_lookups_total", "Session cache lookups by result.",
+        lambda: {(("result", "hit"),): user_memory_managers.hits, (("result", "miss"),): user_memory_managers.misses},
+        kind="counter",
+    )
+    metrics.gauge(
+        "tone_session_cache_evictions_total", "Sessions dropped from the cache by reason.",
+        lambda: {(("reason", "capacity"),): user_memory_managers.evictions, (("reason", "expired"),): user_memory_managers.expirations},
+        kind="counter",
+    )
+    metrics.gauge(
+        "tone_profile_cache_lookups_total", "Profile cache lookups by result.",
+        lambda: {(("result", key),): value for key, value in profile_store.cache_stats().items() if key in ("hits", "misses", "stale")},
+        kind="counter",
+    )
+    metrics.gauge("tone_pending_profiles", "Profiles with unflushed write-behind changes.", profile_store.pending_count)
+    metrics.gauge("tone_pending_conversation_turns", "Conversation turns not yet written to the log.", conversation_store.pending_count)
+    metrics.gauge("tone_pending_feedback_events", "Feedback events not yet written to the log.", feedback_log.pending_count)
+    metrics.gauge("tone_admission_active", "Requests holding an admission slot.", lambda: admission.stats()["active"])
+    metrics.gauge("tone_admission_queue_depth", "Requests waiting for an admission slot.", lambda: admission.stats()["queued"])
+    metrics.gauge(
+        "tone_admission_rejected_total", "Requests answered with 429 by reason.",
+        lambda: {(("reason", reason),): count for reason, count in admission.stats()["rejected"].items()},
+        kind="counter",
+    )
+    if session_store is not None:
+        metrics.gauge(
+            "tone_session_store_conflicts_total", "Session writes retried because another worker wrote first.",
+            lambda: session_store.conflicts, kind="counter",
+        )
+
+def create_app(config=None):
+    """Builds the app and initializes every component once.
+
+    Engines, the schema, caches and compiled assets are all set up before
+    the app is returned, so no request pays for them. ``config`` overrides
+    settings read from the environment. Components are module-level, so
+    build one app per process. With a pre-forking server, build it in the
+    parent, e.g. ``gunicorn --preload "app:create_app()"``: workers then
+    start warm and share the preloaded memory copy-on-write, and each opens
+    its own database and session store connections after the fork.
+    """
+    global write_engine, read_engine, session_store, llm_backend, embedder, user_memory_managers, _fork_handler_installed
+    timings = {"imports": IMPORT_SECONDS}
+    phase_started = time.perf_counter()
+
+    def lap(phase):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[phase] = now - phase_started
+        phase_started = now
+
+    app = Flask(__name__, static_folder=None)
+    # Enable Cross-Origin Resource Sharing
+    CORS(app)
+    load_config(app, config)
+
+    # Initialize the database with the app
+    db.init_app(app)
+    write_engine, read_engine = init_storage(app)
+    lap("storage")
+    init_schema(app)
+    lap("schema")
+
+    metrics.init_app(app, write_engine, read_engine)
+    trace_log.init_app(app)
+    tone_compiler.init_app(app)
+    admission.init_app(app)
+    assets.init_app(app)
+    profile_store.init_app(app)
+    conversation_store.init_app(app)
+    feedback_log.init_app(app, write_engine)
+    feedback_log.on_patterns = lambda user_ids: [profile_store.invalidate(user_id) for user_id in user_ids]
+    session_store = create_session_store(app.config)
+    llm_backend = create_backend(app.config)
+
+    # Evicted sessions flush their on-disk recall index; the conversation itself is already in the log. Requests
+    # may still hold an evicted session, so its files are closed when the last of them drops it.
+    user_memory_managers = SessionCache(
+        max_entries=app.config["SESSION_CACHE_MAX_ENTRIES"],
+        max_bytes=app.config["SESSION_CACHE_MAX_BYTES"],
+        idle_ttl=app.config["SESSION_IDLE_TTL"],
+        on_evict=lambda user_id, memory_manager, reason: memory_manager.flush(),
+        sizeof=MemoryManager.approximate_size,
+    )
+    if app.config["EMBEDDINGS_ENABLED"] and not numpy_available():
+        logger.warning("numpy is not installed; conversation recall is disabled.")
+        app.config["EMBEDDINGS_ENABLED"] = False
+    embedder = HashingEmbedder(app.config["EMBEDDING_DIM"]) if app.config["EMBEDDINGS_ENABLED"] else None
+    # Flush memory-mapped indexes of sessions still cached at shutdown.
+    atexit.register(lambda: [memory_manager.close() for memory_manager in user_memory_managers.values()])
+    _register_gauges()
+
+    app.register_blueprint(bp)
+    assets.compile_page(app, "index", INDEX_HTML)
+    lap("components")
+
+    warmed = warm_up(app) if app.config["WARMUP_ENABLED"] else 0
+    lap("warm_up")
+    if not _fork_handler_installed and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+        _fork_handler_installed = True
+
+    startup = sum(seconds for phase, seconds in timings.items() if phase != "imports")
+    app.extensions["startup"] = {"seconds": dict(timings, total=startup), "warmed_profiles": warmed}
+    metrics.gauge(
+        "tone_startup_seconds", "Time spent in each startup phase of this process.",
+        lambda: {(("phase", phase),): seconds for phase, seconds in timings.items()},
+    )
+    logger.info(
+        "Adaptive Tone started in %.3fs after %.3fs of imports (%s); warmed %d profiles.",
+        startup, IMPORT_SECONDS,
+        ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items() if phase != "imports"), warmed,
+    )
+    return app
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Fingerprinted, precompressed static assets and the compiled index page.
+
+At startup every file under the static directory is read once, named after
+its content hash (``app.css`` -> ``app.3f2a9c1be07d.css``) and compressed
+with gzip, and with Brotli when the ``brotli`` package is installed. The
+index page is rendered once against those names. Requests then only pick a
+prebuilt variant: no template rendering, compression or file I/O per hit.
+
+Hashed assets never change under the same URL, so they are served with a
+one-year ``immutable`` cache lifetime. The page itself is revalidated on
+every load (``no-cache``) and answered with 304 while its ETag still matches.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are optional; gzip is always built.
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Browsers prefer br when offered; identity is the fallback.
+_ENCODINGS = ("br", "gzip")
+
+
+class Asset:
+    """One response body in every encoding it was built with."""
+
+    __slots__ = ("content_type", "cache_control", "variants", "etags")
+
+    def __init__(self, data, content_type, cache_control, min_compress_size=256):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.variants = {"identity": data}
+        if len(data) >= min_compress_size:
+            for encoding, compress in (("gzip", _gzip), ("br", _brotli)):
+                compressed = compress(data)
+                if compressed is not None and len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        # Strong ETags must differ between encodings of the same content.
+        self.etags = {
+            encoding: digest if encoding == "identity" else f"{digest}-{encoding}"
+            for encoding in self.variants
+        }
+
+    def negotiate(self, accept_encodings):
+        """Returns the best encoding the client accepts."""
+        for encoding in _ENCODINGS:
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return "identity"
+
+
+def _gzip(data):
+    # mtime=0 keeps the output, and so the ETag, identical across restarts.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11) if brotli is not None else None
+
+
+def brotli_available():
+    """Returns True when Brotli variants are built."""
+    return brotli is not None
+
+
+class AssetPipeline:
+    """Builds and serves the static assets and the index page."""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.url_prefix = "/assets"
+        self.min_compress_size = 256
+        self.urls = {}
+        self.assets = {}
+        self.pages = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Builds every asset under ``STATIC_DIR`` and registers the asset route."""
+        self.directory = app.config.get("STATIC_DIR") or os.path.join(app.root_path, "static")
+        self.url_prefix = app.config.get("STATIC_URL_PREFIX", self.url_prefix).rstrip("/")
+        self.min_compress_size = int(app.config.get("STATIC_MIN_COMPRESS_SIZE", self.min_compress_size))
+        self.build()
+        app.add_url_rule(f"{self.url_prefix}/<path:filename>", "asset", self.serve_asset)
+
+    def build(self):
+        """Reads, fingerprints and compresses every file in the static directory."""
+        self.urls, self.assets = {}, {}
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, files in os.walk(self.directory):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as handle:
+                    data = handle.read()
+                stem, ext = os.path.splitext(name)
+                hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                self.assets[hashed] = Asset(data, content_type, IMMUTABLE, self.min_compress_size)
+                self.urls[name] = f"{self.url_prefix}/{hashed}"
+
+    def asset_url(self, name):
+        """Returns the fingerprinted URL of a file in the static directory."""
+        try:
+            return self.urls[name]
+        except KeyError:
+            raise KeyError(f"Unknown static asset {name!r} (looked in {self.directory})") from None
+
+    def compile_page(self, app, name, source, **context):
+        """Renders a template once; ``asset_url`` is available inside it."""
+        with app.app_context():
+            html = app.jinja_env.from_string(source).render(asset_url=self.asset_url, **context)
+        self.pages[name] = Asset(html.encode("utf-8"), "text/html; charset=utf-8", REVALIDATE,
+                                 self.min_compress_size)
+
+    def serve_page(self, name):
+        return self._respond(self.pages[name])
+
+    def serve_asset(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return Response("Not Found", status=404, mimetype="text/plain")
+        return self._respond(asset)
+
+    def _respond(self, asset):
+        encoding = asset.negotiate(request.accept_encodings)
+        etag = asset.etags[encoding]
+        # If-None-Match uses the weak comparison, so W/"<etag>" matches too (RFC 7232).
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding], content_type=asset.content_type)
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = asset.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+# Shared pipeline, configured with the app like the SQLAlchemy instance.
+assets = AssetPipeline()
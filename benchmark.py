@@ -0,0 +1,373 @@
+"""Load and latency benchmarks for the Flask API.
+
+Drives the API with realistic traffic mixes, either in-process through the
+Flask test client or over HTTP against a local WSGI server, and reports
+throughput plus p50/p95/p99 latency per endpoint and per stage:
+
+    python benchmark.py --scenario all --requests 1000 --concurrency 8 --output results.json
+    python benchmark.py --baseline results.json
+
+Benchmarks run against a temporary SQLite database unless DATABASE_URL is
+set, so tone_system.db is never touched. With ``--baseline`` the run exits
+with status 1 if any latency or throughput figure regressed by more than
+``--threshold``.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ("many_users", "hot_users", "long_history", "feedback_heavy")
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed=None):
+    """Turns a list of latencies in seconds into a summary in milliseconds."""
+    ordered = sorted(samples)
+    summary = {
+        "count": len(ordered),
+        "mean_ms": (sum(ordered) / len(ordered) * 1000) if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+    if elapsed:
+        summary["throughput_rps"] = len(ordered) / elapsed
+    return summary
+
+
+# --- Traffic models ---
+
+def _chat(user_id, message, feedback=None):
+    body = {"user_id": user_id, "message": message, "context": random.choice(["personal", "work"])}
+    if feedback:
+        body["feedback_on_previous"] = feedback
+    return ("POST", "/api/chat", body, "POST /api/chat")
+
+
+def _profile_get(user_id):
+    return ("GET", f"/api/profile/{user_id}", None, "GET /api/profile/<user_id>")
+
+
+def _memory_get(user_id):
+    return ("GET", f"/api/memory/{user_id}", None, "GET /api/memory/<user_id>")
+
+
+def _profile_post(user_id):
+    tone = {
+        "formality": random.choice(["casual", "professional", "formal"]),
+        "enthusiasm": random.choice(["low", "medium", "high"]),
+        "verbosity": random.choice(["concise", "balanced", "detailed"]),
+        "persona": random.choice(["neutral", "friendly", "witty", "professional"]),
+        "humor": random.choice(["none", "punny"]),
+    }
+    body = {"user_id": user_id, "preferences": {"tone_preferences": tone, "communication_style": {"technical_level": "intermediate"}}}
+    return ("POST", "/api/profile", body, "POST /api/profile")
+
+
+def build_scenario(name, requests):
+    """Returns ``(user_ids, warmup_ops, ops)`` for a traffic model."""
+    if name == "many_users":
+        users = [f"bench_many_{i}" for i in range(max(50, requests // 2))]
+        pick = lambda: random.choice(users)
+        warmup = []
+    elif name == "hot_users":
+        hot = [f"bench_hot_{i}" for i in range(5)]
+        cold = [f"bench_cold_{i}" for i in range(200)]
+        users = hot + cold
+        pick = lambda: random.choice(hot) if random.random() < 0.8 else random.choice(cold)
+        warmup = []
+    elif name == "long_history":
+        users = [f"bench_long_{i}" for i in range(10)]
+        pick = lambda: random.choice(users)
+        # Fill every history up to the prompt budget before measuring.
+        warmup = [_chat(user_id, f"warm-up message {turn} " + "lorem ipsum " * 20) for user_id in users for turn in range(40)]
+    elif name == "feedback_heavy":
+        users = [f"bench_feedback_{i}" for i in range(50)]
+        pick = lambda: random.choice(users)
+        warmup = []
+    else:
+        raise ValueError(f"Unknown scenario: {name}")
+
+    ops = []
+    for i in range(requests):
+        user_id = pick()
+        roll = random.random()
+        if name == "feedback_heavy":
+            if roll < 0.8:
+                ops.append(_chat(user_id, f"message {i}", random.choice(["positive", "negative"])))
+            else:
+                ops.append(_profile_get(user_id))
+        elif roll < 0.6:
+            ops.append(_chat(user_id, f"message {i}"))
+        elif roll < 0.8:
+            ops.append(_profile_get(user_id))
+        elif roll < 0.95:
+            ops.append(_memory_get(user_id))
+        else:
+            ops.append(_profile_post(user_id))
+    return users, warmup, ops
+
+
+# --- Transports ---
+
+class TestClientTransport:
+    """Sends requests in-process through the Flask test client."""
+
+    name = "test-client"
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class WSGIServerTransport:
+    """Sends requests over HTTP to a threaded local WSGI server."""
+
+    name = "wsgi"
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, body):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+# --- Stage timing ---
+
+class StageTimer:
+    """Times the main stages of a chat request by wrapping app objects."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._restore = []
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, owner, attribute, stage):
+        original = getattr(owner, attribute)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(owner, attribute, timed)
+        self._restore.append((owner, attribute, original))
+
+    def install(self, app_module):
+        from memory_manager import MemoryManager
+        from prompt_builder import PromptBuilder
+        from tone_engine import ToneEngine
+        self.wrap(app_module.profile_store, "get", "get_user")
+        self.wrap(app_module.profile_store, "record_interaction", "update_user")
+        # Stages must not nest, so that together they add up to at most the request time.
+        self.wrap(ToneEngine, "_analyze_context", "analyze_context")
+        self.wrap(MemoryManager, "recall", "recall")
+        self.wrap(PromptBuilder, "build", "prompt_build")
+        self.wrap(app_module.llm_backend, "generate", "generation")
+
+    def uninstall(self):
+        for owner, attribute, original in reversed(self._restore):
+            setattr(owner, attribute, original)
+        self._restore = []
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+
+# --- Runner ---
+
+def run_scenario(name, transport, timer, requests, concurrency):
+    users, warmup, ops = build_scenario(name, requests)
+    for user_id in users:
+        transport.request(*_profile_post(user_id)[:3])
+    for method, path, body, _ in warmup:
+        transport.request(method, path, body)
+    timer.reset()
+
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def send(op):
+        method, path, body, endpoint = op
+        start = time.perf_counter()
+        status = transport.request(method, path, body)
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.setdefault(endpoint, []).append(elapsed)
+            if status >= 400:
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, ops))
+    elapsed = time.perf_counter() - started
+
+    all_samples = [value for values in samples.values() for value in values]
+    return {
+        "requests": len(ops),
+        "elapsed_s": elapsed,
+        "overall": summarize(all_samples, elapsed),
+        "endpoints": {endpoint: dict(summarize(values, elapsed), errors=errors.get(endpoint, 0)) for endpoint, values in sorted(samples.items())},
+        "stages": {stage: summarize(values) for stage, values in sorted(timer.samples.items())},
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms=0.5):
+    """Lists metrics that got worse than the baseline by more than ``threshold``.
+
+    Latency changes smaller than ``min_delta_ms`` are treated as noise.
+    """
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        groups = [("overall", {"overall": current["overall"]}, {"overall": previous["overall"]})]
+        groups.append(("endpoint", current["endpoints"], previous.get("endpoints", {})))
+        groups.append(("stage", current["stages"], previous.get("stages", {})))
+        for kind, now_group, before_group in groups:
+            for key, now in now_group.items():
+                before = before_group.get(key)
+                if not before:
+                    continue
+                for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                    if before.get(metric) is None or now[metric] - before[metric] < min_delta_ms:
+                        continue
+                    if now[metric] > before[metric] * (1 + threshold):
+                        regressions.append(f"{scenario} {kind} {key} {metric}: {before[metric]:.2f} -> {now[metric]:.2f}")
+                if before.get("throughput_rps") and now.get("throughput_rps", 0) < before["throughput_rps"] * (1 - threshold):
+                    regressions.append(f"{scenario} {kind} {key} throughput_rps: {before['throughput_rps']:.1f} -> {now['throughput_rps']:.1f}")
+    return regressions
+
+
+def print_report(results):
+    for scenario, result in results["scenarios"].items():
+        overall = result["overall"]
+        print(f"\n== {scenario}: {result['requests']} requests, {overall['throughput_rps']:.1f} req/s ==")
+        print(f"{'':32} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for label, rows in (("endpoint", result["endpoints"]), ("stage", result["stages"])):
+            for key, row in rows.items():
+                print(f"{label[0]} {key:30} {row['count']:>7} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Adaptive Tone API.")
+    parser.add_argument("--scenario", default="all", choices=SCENARIOS + ("all",))
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--transport", default="test-client", choices=("test-client", "wsgi"))
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare against a previous JSON result.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed fractional slowdown before flagging a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore latency changes smaller than this.")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    scratch = None
+    if "DATABASE_URL" not in os.environ:
+        scratch = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch.name, 'bench.db')}"
+
+    import app as app_module
+    flask_app = app_module.create_app()
+
+    transport = (WSGIServerTransport if args.transport == "wsgi" else TestClientTransport)(flask_app)
+    timer = StageTimer()
+    timer.install(app_module)
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "transport": transport.name,
+        "concurrency": args.concurrency,
+        "python": sys.version.split()[0],
+        "scenarios": {},
+    }
+    try:
+        for name in scenarios:
+            results["scenarios"][name] = run_scenario(name, transport, timer, args.requests, args.concurrency)
+    finally:
+        timer.uninstall()
+        transport.close()
+        app_module.profile_store.flush()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        for setting in ("transport", "concurrency"):
+            if baseline.get(setting) != results[setting]:
+                print(f"\nWarning: baseline {setting} is {baseline.get(setting)!r}, this run used {results[setting]!r}.")
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            status = 1
+        else:
+            print(f"\nNo regressions against {args.baseline}.")
+    if scratch is not None:
+        scratch.cleanup()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import atexit
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from database import (
+    append_turns, compact_turns, get_conversation_summary, get_recent_turns, has_turn_with_role, users_to_compact
+)
+from storage import read_session
+from trace_log import logger
+
+# Logged when a user's short-term memory is cleared; hydration stops here.
+CLEAR_MARKER = "clear"
+
+_WORD_RE = re.compile(r"[a-z][a-z']{3,}")
+_STOPWORDS = frozenset(
+    "about after again also because been before being could does doing from have having here "
+    "into just like more most much only other over some such than that their them then there "
+    "these they this those through very what when where which while will with would your you're "
+    "there's that's it's what's don't tell know want need think please probably".split()
+)
+
+
+def summarize_turns(state, turns, max_topics=12, max_highlights=5):
+    """Merges compacted turns into a summary state and renders it as text.
+
+    This is a local extractive summary: frequent topic words and the most
+    recent user requests, so it needs no model call. A clear marker starts
+    the summary over, so turns the user cleared never reach it.
+    """
+    for index in range(len(turns) - 1, -1, -1):
+        if turns[index].role == CLEAR_MARKER:
+            state, turns = None, turns[index + 1:]
+            break
+    state = dict(state or {})
+    topics = Counter(state.get("topics") or {})
+    highlights = list(state.get("highlights") or [])
+    if not turns:
+        return state, None
+    for turn in turns:
+        words = [word for word in _WORD_RE.findall(turn.message.lower()) if word not in _STOPWORDS]
+        topics.update(words)
+        if turn.role == "user":
+            highlights.append(turn.message if len(turn.message) <= 120 else turn.message[:117] + "...")
+    state["topics"] = dict(topics.most_common(max_topics * 4))
+    state["highlights"] = highlights[-max_highlights:]
+    state["first_at"] = state.get("first_at") or turns[0].created_at.isoformat()
+    state["last_at"] = turns[-1].created_at.isoformat()
+    state["turns"] = state.get("turns", 0) + len(turns)
+
+    text = f"{state['turns']} earlier turns between {state['first_at'][:10]} and {state['last_at'][:10]}."
+    if topics:
+        text += " Frequent topics: " + ", ".join(word for word, _ in topics.most_common(max_topics)) + "."
+    if state["highlights"]:
+        text += " Recent requests: " + "; ".join(f'"{message}"' for message in state["highlights"]) + "."
+    return state, text
+
+
+class ConversationStore:
+    """Append-only, per-user conversation log in the application database.
+
+    Appends are buffered and written in one multi-row insert every
+    ``flush_interval`` seconds, once ``max_pending`` turns are waiting, or at
+    shutdown. New sessions hydrate only the newest ``hydrate_turns`` turns,
+    so cold-start cost does not grow with history length. Every
+    ``compact_interval`` seconds, turns beyond the newest ``compact_keep``
+    are folded into a stored summary and deleted.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.flush_interval = 1.0
+        self.max_pending = 500
+        self.hydrate_turns = 20
+        self.compact_interval = 300.0
+        self.compact_keep = 200
+        self._pending = []
+        self._lock = threading.Lock()
+        # Held while a batch is written so hydration never sees it half-flushed.
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_compaction = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the conversation log settings from the app config."""
+        self.app = app
+        self.enabled = app.config.get("CONVERSATION_STORE_ENABLED", True)
+        self.flush_interval = float(app.config.get("CONVERSATION_FLUSH_INTERVAL", self.flush_interval))
+        self.max_pending = int(app.config.get("CONVERSATION_FLUSH_MAX_PENDING", self.max_pending))
+        self.hydrate_turns = int(app.config.get("CONVERSATION_HYDRATE_TURNS", self.hydrate_turns))
+        self.compact_interval = float(app.config.get("CONVERSATION_COMPACT_INTERVAL", self.compact_interval))
+        self.compact_keep = max(self.hydrate_turns, int(app.config.get("CONVERSATION_COMPACT_KEEP", self.compact_keep)))
+        if self.enabled:
+            atexit.register(self.shutdown)
+
+    def append(self, user_id, exchanges, context=None):
+        """Queues exchanges for the user's log."""
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "role": exchange["role"], "message": exchange["message"],
+             "context": context, "created_at": now}
+            for exchange in exchanges
+        ]
+        with self._lock:
+            self._pending.extend(rows)
+            pending_count = len(self._pending)
+        self._ensure_flusher()
+        if pending_count >= self.max_pending:
+            self._wakeup.set()
+
+    def mark_cleared(self, user_id):
+        """Records that the user's memory was cleared, so it is not hydrated again."""
+        self.append(user_id, [{"role": CLEAR_MARKER, "message": ""}])
+
+    def load_recent(self, user_id):
+        """Returns the newest turns since the last clear, oldest first."""
+        if not self.enabled:
+            return []
+        with self._flush_lock:
+            turns = get_recent_turns(user_id, self.hydrate_turns, session=read_session)
+            with self._lock:
+                pending = [
+                    {"role": row["role"], "message": row["message"], "context": row["context"]}
+                    for row in self._pending if row["user_id"] == user_id
+                ]
+        turns = (turns + pending)[-self.hydrate_turns:]
+        for index in range(len(turns) - 1, -1, -1):
+            if turns[index]["role"] == CLEAR_MARKER:
+                turns = turns[index + 1:]
+                break
+        return turns
+
+    def summary(self, user_id):
+        """Returns the text summary of a user's compacted turns, or None.
+
+        While a clear marker is still in the log, the stored summary only
+        covers turns from before the clear, so there is nothing to show.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if any(row["user_id"] == user_id and row["role"] == CLEAR_MARKER for row in self._pending):
+                return None
+        if has_turn_with_role(user_id, CLEAR_MARKER, session=read_session):
+            return None
+        row = get_conversation_summary(user_id, session=read_session)
+        return row.summary if row else None
+
+    def pending_count(self):
+        """Returns the number of turns not yet written."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes every pending turn to the database in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                with self.app.app_context():
+                    append_turns(pending)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+        return len(pending)
+
+    def compact(self):
+        """Summarizes and removes old turns for every user with a long log."""
+        compacted = 0
+        with self.app.app_context():
+            for user_id in users_to_compact(self.compact_keep):
+                compacted += compact_turns(user_id, self.compact_keep, summarize_turns)
+        return compacted
+
+    def shutdown(self):
+        """Stops the background writer and writes out anything pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _ensure_flusher(self):
+        """Starts the background writer thread on first use."""
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._last_compaction = time.monotonic()
+                self._thread = threading.Thread(target=self._run, name="conversation-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.compact_interval and time.monotonic() - self._last_compaction >= self.compact_interval:
+                    self._last_compaction = time.monotonic()
+                    self.compact()
+            except Exception:
+                logger.exception("Conversation log write failed, will retry")
@@ -1,35 +1,458 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, delete, exists, func, insert, select, update
 from datetime import datetime
 import json
 
 # Create the SQLAlchemy instance
 db = SQLAlchemy()
 
+# Profile sections stored as rows in user_preferences.
+PREFERENCE_SECTIONS = ('tone_preferences', 'communication_style')
+# interaction_history counters stored as integer columns on users.
+COUNTER_FIELDS = ('total_interactions', 'successful_tone_matches', 'feedback_score')
+
 class User(db.Model):
     """Represents a user in the database."""
     __tablename__ = 'users'
     user_id = db.Column(db.String, primary_key=True)
+    total_interactions = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    successful_tone_matches = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    feedback_score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_interaction = db.Column(db.DateTime, index=True)
+    # Incremented on every write so other processes can detect stale cached copies.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Any remaining profile fields that have no dedicated column.
     profile_data = db.Column(db.JSON)
+    preferences = db.relationship(
+        'UserPreference', lazy='selectin', cascade='all, delete-orphan',
+        order_by='UserPreference.position'
+    )
+
+class UserPreference(db.Model):
+    """A single tone preference or communication style setting."""
+    __tablename__ = 'user_preferences'
+    user_id = db.Column(db.String, db.ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    section = db.Column(db.String, primary_key=True)
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.JSON)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+class ConversationTurn(db.Model):
+    """One exchange in a user's append-only conversation log."""
+    __tablename__ = 'conversation_turns'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String, nullable=False)
+    role = db.Column(db.String, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    context = db.Column(db.String)
+    created_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('ix_conversation_turns_user_id_id', 'user_id', 'id'),)
+
+class ConversationSummary(db.Model):
+    """Rolled-up summary of a user's compacted conversation turns."""
+    __tablename__ = 'conversation_summaries'
+    user_id = db.Column(db.String, primary_key=True)
+    turns = db.Column(db.Integer, nullable=False, default=0)
+    through_id = db.Column(db.Integer, nullable=False, default=0)
+    state = db.Column(db.JSON)
+    summary = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime)
+
+class FeedbackEvent(db.Model):
+    """One piece of feedback on the tone applied to a response."""
+    __tablename__ = 'feedback_events'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String, nullable=False)
+    context = db.Column(db.String)
+    tone = db.Column(db.JSON, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = (db.Index('ix_feedback_events_user_id_id', 'user_id', 'id'),)
+
+class FeedbackAggregate(db.Model):
+    """How far each user's feedback has been folded into their tone patterns."""
+    __tablename__ = 'feedback_aggregates'
+    user_id = db.Column(db.String, primary_key=True)
+    events = db.Column(db.Integer, nullable=False, default=0)
+    through_id = db.Column(db.Integer, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime)
+
+def _parse_timestamp(value):
+    """Converts a stored ISO timestamp string to a datetime."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def _preference_rows(user_id, profile):
+    """Builds UserPreference rows for the preference sections of a profile."""
+    rows = []
+    for section in PREFERENCE_SECTIONS:
+        for position, (name, value) in enumerate((profile.get(section) or {}).items()):
+            rows.append(UserPreference(user_id=user_id, section=section, name=name, value=value, position=position))
+    return rows
+
+def _extra_fields(profile):
+    """Returns the profile fields that are not stored in columns or side tables."""
+    extra = {key: value for key, value in profile.items() if key not in ('user_id', 'interaction_history') + PREFERENCE_SECTIONS}
+    history = {key: value for key, value in (profile.get('interaction_history') or {}).items() if key not in COUNTER_FIELDS + ('last_interaction',)}
+    if history:
+        extra['interaction_history'] = history
+    return extra
+
+def _to_profile(user):
+    """Assembles the profile dict for a User row."""
+    return _assemble_profile(
+        user.user_id, user.profile_data,
+        [(preference.section, preference.name, preference.value) for preference in user.preferences],
+        {field: getattr(user, field) for field in COUNTER_FIELDS}, user.last_interaction,
+    )
+
+def _assemble_profile(user_id, profile_data, preferences, counters, last_interaction):
+    """Builds a profile dict from column values and ``(section, name, value)`` preference rows."""
+    profile = dict(profile_data or {})
+    profile['user_id'] = user_id
+    for section in PREFERENCE_SECTIONS:
+        profile[section] = {}
+    for section, name, value in preferences:
+        profile.setdefault(section, {})[name] = value
+
+    history = dict(profile.get('interaction_history') or {})
+    for field in COUNTER_FIELDS:
+        history[field] = counters[field] or 0
+    history['last_interaction'] = last_interaction.isoformat() if last_interaction else None
+    profile['interaction_history'] = history
+    return profile
 
 def create_user(profile):
     """Creates a new user in the database."""
     profile['interaction_history']['last_interaction'] = datetime.utcnow().isoformat()
-    new_user = User(user_id=profile['user_id'], profile_data=profile)
+    history = profile['interaction_history']
+    new_user = User(
+        user_id=profile['user_id'],
+        total_interactions=history.get('total_interactions', 0),
+        successful_tone_matches=history.get('successful_tone_matches', 0),
+        feedback_score=history.get('feedback_score', 0),
+        last_interaction=_parse_timestamp(history['last_interaction']),
+        profile_data=_extra_fields(profile),
+    )
+    new_user.preferences = _preference_rows(profile['user_id'], profile)
     db.session.add(new_user)
     db.session.commit()
 
-def get_user(user_id):
-    """Retrieves a user's profile from the database."""
-    user = User.query.get(user_id)
+def get_user(user_id, session=None):
+    """Retrieves a user's profile from the database.
+
+    Pass ``session`` to read through a different session, such as the
+    read-only one used by GET endpoints.
+    """
+    user = (session or db.session).get(User, user_id)
     if user:
-        return user.profile_data
+        return _to_profile(user)
     return None
 
+def get_user_record(user_id, session=None):
+    """Returns ``(profile, version)`` for a user, or ``(None, None)``."""
+    user = (session or db.session).get(User, user_id)
+    if user:
+        return _to_profile(user), user.version
+    return None, None
+
+def get_users(user_ids):
+    """Retrieves several profiles in one query, keyed by user_id."""
+    return {user_id: profile for user_id, (profile, _) in get_user_records(user_ids).items()}
+
+def get_user_records(user_ids):
+    """Retrieves ``(profile, version)`` for several users in one query, keyed by user_id."""
+    if not user_ids:
+        return {}
+    users = User.query.filter(User.user_id.in_(list(user_ids))).all()
+    return {user.user_id: (_to_profile(user), user.version) for user in users}
+
+def get_recent_user_records(limit, session=None):
+    """Returns ``(profile, version)`` for the ``limit`` most recently active users, keyed by user_id."""
+    users = (session or db.session).query(User).filter(User.last_interaction.isnot(None)).order_by(
+        User.last_interaction.desc()
+    ).limit(limit).all()
+    return {user.user_id: (_to_profile(user), user.version) for user in users}
+
+def get_user_versions(user_ids, session=None):
+    """Returns the current version of each user without loading their profiles."""
+    if not user_ids:
+        return {}
+    rows = (session or db.session).query(User.user_id, User.version).filter(User.user_id.in_(list(user_ids))).all()
+    return dict(rows)
+
 def update_user(user_id, profile):
-    """Updates an existing user's profile."""
+    """Updates an existing user's profile.
+
+    Preferences are rewritten only when they changed, and the interaction
+    counter is incremented in the database rather than overwritten.
+    """
     user = User.query.get(user_id)
     if user:
-        profile['interaction_history']['last_interaction'] = datetime.utcnow().isoformat()
+        now = datetime.utcnow()
+        profile['interaction_history']['last_interaction'] = now.isoformat()
         profile['interaction_history']['total_interactions'] = profile['interaction_history'].get('total_interactions', 0) + 1
-        user.profile_data = profile
-        db.session.commit()
\ No newline at end of file
+
+        rows = _preference_rows(user_id, profile)
+        current = [(p.section, p.name, p.value) for p in user.preferences]
+        if current != [(p.section, p.name, p.value) for p in rows]:
+            user.preferences = rows
+        extra = _extra_fields(profile)
+        if extra != (user.profile_data or {}):
+            user.profile_data = extra
+        user.total_interactions = User.total_interactions + 1
+        user.last_interaction = now
+        user.version = User.version + 1
+        db.session.commit()
+
+def apply_profile_updates(updates):
+    """Applies a batch of coalesced profile updates in a single transaction.
+
+    ``updates`` maps a user_id to a ``(profile, deltas, last_interaction)``
+    tuple. Only the interaction counters and last_interaction are written;
+    each counter is incremented in place with ``SET x = x + delta`` so
+    increments recorded by different requests are never lost. Each user's
+    version goes up by exactly one.
+    """
+    if not updates:
+        return
+    statement = (
+        update(User.__table__)
+        .where(User.__table__.c.user_id == bindparam('_user_id'))
+        .values(
+            last_interaction=bindparam('_last_interaction'),
+            version=User.__table__.c.version + 1,
+            **{field: User.__table__.c[field] + bindparam(f'_{field}') for field in COUNTER_FIELDS}
+        )
+    )
+    params = []
+    for user_id, (_, deltas, last_interaction) in updates.items():
+        row = {'_user_id': user_id, '_last_interaction': _parse_timestamp(last_interaction)}
+        for field in COUNTER_FIELDS:
+            row[f'_{field}'] = deltas.get(field, 0)
+        params.append(row)
+    db.session.execute(statement, params)
+    db.session.commit()
+
+# --- Conversation Log ---
+def append_turns(rows):
+    """Appends conversation turns in one multi-row insert and commits."""
+    if not rows:
+        return
+    db.session.execute(ConversationTurn.__table__.insert(), rows)
+    db.session.commit()
+
+def get_recent_turns(user_id, limit, session=None):
+    """Returns a user's newest ``limit`` turns, oldest first.
+
+    The (user_id, id) index makes this a short range scan regardless of how
+    long the user's history is.
+    """
+    turns = (session or db.session).query(ConversationTurn).filter(
+        ConversationTurn.user_id == user_id
+    ).order_by(ConversationTurn.id.desc()).limit(limit).all()
+    return [
+        {"role": turn.role, "message": turn.message, "context": turn.context}
+        for turn in reversed(turns)
+    ]
+
+def has_turn_with_role(user_id, role, session=None):
+    """Returns True if the user's log still holds a turn with ``role``."""
+    return (session or db.session).query(
+        exists().where(ConversationTurn.user_id == user_id, ConversationTurn.role == role)
+    ).scalar()
+
+def get_conversation_summary(user_id, session=None):
+    """Returns the stored summary row for a user, or None."""
+    return (session or db.session).get(ConversationSummary, user_id)
+
+def users_to_compact(min_turns):
+    """Returns ids of users whose conversation log has more than ``min_turns`` turns."""
+    rows = db.session.query(ConversationTurn.user_id).group_by(
+        ConversationTurn.user_id
+    ).having(func.count() > min_turns).all()
+    return [user_id for user_id, in rows]
+
+def compact_turns(user_id, keep, summarize):
+    """Folds all but a user's newest ``keep`` turns into their summary.
+
+    ``summarize(state, turns)`` receives the previous summary state (or
+    None) and the turns being removed, and returns ``(state, text)``.
+    """
+    turns = ConversationTurn.query.filter(ConversationTurn.user_id == user_id).order_by(
+        ConversationTurn.id.desc()
+    ).offset(keep).all()
+    if not turns:
+        return 0
+    turns.reverse()
+    summary = db.session.get(ConversationSummary, user_id) or ConversationSummary(user_id=user_id, turns=0, through_id=0)
+    summary.state, summary.summary = summarize(summary.state, turns)
+    summary.turns += len(turns)
+    summary.through_id = turns[-1].id
+    summary.updated_at = datetime.utcnow()
+    db.session.add(summary)
+    db.session.execute(delete(ConversationTurn.__table__).where(
+        ConversationTurn.user_id == user_id, ConversationTurn.id <= summary.through_id
+    ))
+    db.session.commit()
+    return len(turns)
+
+# --- Bulk Import/Export ---
+def upsert_profiles(connection, profiles):
+    """Creates or updates many profiles on a Core connection.
+
+    Runs a fixed number of statements however many profiles are given; the
+    caller owns the transaction. A preference section or extra field in a
+    profile replaces the stored one, and anything left out is kept, so a
+    record can carry only the fields being changed. Counters in
+    ``interaction_history`` are set, not incremented. New users start at the
+    column's default version of 0 and every updated user's version goes up
+    by one. Returns ``(created, updated)`` lists of user ids.
+    """
+    users, preferences = User.__table__, UserPreference.__table__
+    user_ids = [profile['user_id'] for profile in profiles]
+    existing = {
+        row.user_id: row for row in connection.execute(
+            select(users.c.user_id, users.c.profile_data, users.c.last_interaction,
+                   *[users.c[field] for field in COUNTER_FIELDS])
+            .where(users.c.user_id.in_(user_ids))
+        )
+    }
+    inserts, updates, replaced_sections, preference_rows = [], [], [], []
+    for profile in profiles:
+        user_id = profile['user_id']
+        current = existing.get(user_id)
+        history = profile.get('interaction_history') or {}
+        row = {
+            field: history.get(field, getattr(current, field) if current else 0) for field in COUNTER_FIELDS
+        }
+        row['last_interaction'] = (
+            _parse_timestamp(history['last_interaction']) if 'last_interaction' in history
+            else current.last_interaction if current else None
+        )
+        extra = dict(current.profile_data or {}) if current else {}
+        extra.update(_extra_fields(profile))
+        row['profile_data'] = extra
+        for section in PREFERENCE_SECTIONS:
+            if section in profile:
+                replaced_sections.append({'_user_id': user_id, '_section': section})
+                for position, (name, value) in enumerate((profile[section] or {}).items()):
+                    preference_rows.append({'user_id': user_id, 'section': section, 'name': name,
+                                            'value': value, 'position': position})
+        if current is None:
+            inserts.append(dict(row, user_id=user_id))
+        else:
+            updates.append(dict(row, _user_id=user_id))
+
+    if inserts:
+        connection.execute(insert(users), inserts)
+    if updates:
+        connection.execute(
+            update(users).where(users.c.user_id == bindparam('_user_id'))
+            .values(version=users.c.version + 1), updates
+        )
+    if replaced_sections:
+        connection.execute(
+            delete(preferences).where(preferences.c.user_id == bindparam('_user_id'),
+                                      preferences.c.section == bindparam('_section')),
+            replaced_sections,
+        )
+    if preference_rows:
+        connection.execute(insert(preferences), preference_rows)
+    return [row['user_id'] for row in inserts], [row['_user_id'] for row in updates]
+
+def iter_profiles(connection, chunk_size=1000):
+    """Yields every profile, ordered by user_id, in lists of up to ``chunk_size``.
+
+    Users are read through a server-side cursor (``stream_results``) and each
+    chunk's preferences with one extra query, so memory use does not grow
+    with the number of users.
+    """
+    users, preferences = User.__table__, UserPreference.__table__
+    result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+        select(users).order_by(users.c.user_id)
+    )
+    for rows in result.partitions(chunk_size):
+        user_ids = [row.user_id for row in rows]
+        by_user = {}
+        for preference in connection.execute(
+            select(preferences).where(preferences.c.user_id.in_(user_ids))
+            .order_by(preferences.c.user_id, preferences.c.section, preferences.c.position)
+        ):
+            by_user.setdefault(preference.user_id, []).append((preference.section, preference.name, preference.value))
+        yield [
+            _assemble_profile(
+                row.user_id, row.profile_data, by_user.get(row.user_id, ()),
+                {field: getattr(row, field) for field in COUNTER_FIELDS}, row.last_interaction,
+            )
+            for row in rows
+        ]
+
+# --- Feedback ---
+def append_feedback(rows):
+    """Appends feedback events in one multi-row insert and commits."""
+    if not rows:
+        return
+    db.session.execute(FeedbackEvent.__table__.insert(), rows)
+    db.session.commit()
+
+def users_with_new_feedback(connection, limit):
+    """Returns ``(user_ids, through_id)`` for up to ``limit`` users with unaggregated feedback.
+
+    ``through_id`` is the newest event id the returned users' events reach;
+    events are found by id range above the highest aggregated id.
+    """
+    events, aggregates = FeedbackEvent.__table__, FeedbackAggregate.__table__
+    watermark = connection.execute(select(func.max(aggregates.c.through_id))).scalar() or 0
+    rows = connection.execute(
+        select(events.c.user_id, func.max(events.c.id)).where(events.c.id > watermark)
+        .group_by(events.c.user_id).order_by(func.max(events.c.id)).limit(limit)
+    ).all()
+    return [user_id for user_id, _ in rows], max((last_id for _, last_id in rows), default=watermark)
+
+def get_feedback_events(connection, user_ids, since):
+    """Returns ``(user_id, context, tone, score, created_at)`` rows for users, newer than ``since``."""
+    events = FeedbackEvent.__table__
+    return connection.execute(
+        select(events.c.user_id, events.c.context, events.c.tone, events.c.score, events.c.created_at)
+        .where(events.c.user_id.in_(user_ids), events.c.created_at >= since)
+    ).all()
+
+def save_tone_patterns(connection, patterns, through_id, event_counts):
+    """Stores learned patterns as each user's ``successful_tone_patterns`` and bumps their version.
+
+    Also records ``through_id`` for every user so their events are not
+    aggregated again until new ones arrive. The caller owns the transaction.
+    """
+    users, aggregates = User.__table__, FeedbackAggregate.__table__
+    user_ids = list(patterns)
+    current = dict(connection.execute(
+        select(users.c.user_id, users.c.profile_data).where(users.c.user_id.in_(user_ids))
+    ).all())
+    updates = [
+        {'_user_id': user_id, 'profile_data': dict(current[user_id] or {}, successful_tone_patterns=patterns[user_id])}
+        for user_id in user_ids if user_id in current
+    ]
+    if updates:
+        connection.execute(
+            update(users).where(users.c.user_id == bindparam('_user_id')).values(version=users.c.version + 1),
+            updates,
+        )
+    now = datetime.utcnow()
+    connection.execute(delete(aggregates).where(aggregates.c.user_id.in_(user_ids)))
+    connection.execute(insert(aggregates), [
+        {'user_id': user_id, 'events': event_counts.get(user_id, 0), 'through_id': through_id, 'updated_at': now}
+        for user_id in user_ids
+    ])
+    return [row['_user_id'] for row in updates]
+
+def prune_feedback(connection, before):
+    """Deletes feedback events created before ``before``; returns how many."""
+    events = FeedbackEvent.__table__
+    return connection.execute(delete(events).where(events.c.created_at < before)).rowcount
\ No newline at end of file
@@ -0,0 +1,368 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process lock, so use one worker process with EMBEDDING_DIR.
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # The index is optional; MemoryManager works without it.
+    np = None
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def numpy_available():
+    """Returns True when NumPy is installed and the index can be used."""
+    return np is not None
+
+
+class HashingEmbedder:
+    """Local embedder that hashes word unigrams and bigrams into a fixed vector.
+
+    It needs no model download or network access. Vectors are L2-normalised,
+    so a dot product between two of them is their cosine similarity.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _features(self, text):
+        words = _TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def __call__(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            # crc32 is stable across processes, unlike the built-in hash().
+            code = zlib.crc32(feature.encode("utf-8"))
+            vector[code % self.dim] += 1.0 if code & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+        return vector
+
+
+@contextmanager
+def _file_lock(handle):
+    """Holds an exclusive ``flock`` on an open file."""
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _file_id(handle):
+    stat = os.fstat(handle.fileno())
+    return stat.st_dev, stat.st_ino
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class EmbeddingIndex:
+    """Matrix of exchange embeddings with top-k cosine search.
+
+    Rows live in one contiguous float32 matrix whose capacity doubles when
+    full, so appends are amortised O(1). At most ``max_rows`` exchanges are
+    kept: once full, the oldest quarter is dropped. When ``directory`` is
+    given the matrix is a memory-mapped file and each row's exchange is
+    appended to a JSON-lines sidecar, so the index survives restarts. Only
+    each row's sidecar offset stays on the heap; recalled exchanges are read
+    back from the sidecar.
+
+    The files are created by the first ``add`` and may be shared by several
+    worker processes: each call holds an exclusive lock on the user's
+    ``.lock`` file and first catches up with what the other processes wrote.
+    ``close`` only releases the files; a later call opens them again.
+    """
+
+    def __init__(self, user_id, embedder=None, directory=None, initial_capacity=4, max_rows=1000):
+        self.user_id = user_id
+        self.embedder = embedder or HashingEmbedder()
+        self.dim = self.embedder.dim
+        self.initial_capacity = initial_capacity
+        self.max_rows = max_rows
+        self.size = 0
+        # Exchange dicts by row in memory mode; sidecar byte offsets by row in directory mode.
+        self.exchanges = []
+        self._offsets = None
+        self._message_chars = 0
+        self._context_codes = {}
+        self._contexts = np.zeros(initial_capacity, dtype=np.int32)
+        self._sidecar = None
+        self._path = None
+        self._lock = None
+        # flock does not exclude threads sharing the lock file, so calls are serialized here too.
+        self._thread_lock = threading.RLock()
+        self._vectors = None
+        if directory:
+            self._path, self._sidecar_path, self._lock_path = self.file_paths(user_id, directory)
+            with self._locked():
+                self._load()
+        else:
+            self._vectors = np.zeros((initial_capacity, self.dim), dtype=np.float32)
+
+    @staticmethod
+    def file_paths(user_id, directory):
+        """Returns the vector file, sidecar and lock file paths of a user's index in ``directory``."""
+        name = os.path.join(directory, hashlib.sha1(user_id.encode("utf-8")).hexdigest())
+        return f"{name}.f32", f"{name}.jsonl", f"{name}.lock"
+
+    @classmethod
+    def remove_files(cls, user_id, directory):
+        """Deletes a user's index files, for users without an open index in this process."""
+        if not directory:
+            return
+        vector_path, sidecar_path, lock_path = cls.file_paths(user_id, directory)
+        if not os.path.exists(lock_path):
+            return
+        with open(lock_path, "a+b") as lock, _file_lock(lock):
+            _remove_files(vector_path, sidecar_path)
+
+    @property
+    def shared(self):
+        """True when the rows live in files that other processes may also use."""
+        return self._path is not None
+
+    @property
+    def capacity(self):
+        return self._vectors.shape[0] if self._vectors is not None else 0
+
+    @contextmanager
+    def _locked(self, create=False):
+        """Holds the inter-process lock of a directory index; a no-op in memory mode.
+
+        The lock file is only created when ``create`` is set, so looking up
+        users that never had an exchange leaves nothing on disk.
+        """
+        with self._thread_lock:
+            if self._path and self._lock is None:
+                if create:
+                    os.makedirs(os.path.dirname(self._lock_path), exist_ok=True)
+                if create or os.path.exists(self._lock_path):
+                    self._lock = open(self._lock_path, "a+b")
+            if self._lock is None:
+                yield
+                return
+            with _file_lock(self._lock):
+                yield
+
+    def _reset(self):
+        """Closes the files and forgets every row read from them."""
+        self._close_files()
+        self.size = 0
+        self._sidecar_id = None
+        self._sidecar_end = 0
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._contexts = np.zeros(0, dtype=np.int32)
+
+    def _load(self):
+        """Reads the index files from scratch; the caller holds the lock."""
+        self._reset()
+        if not os.path.exists(self._sidecar_path):
+            return
+        self._sidecar = open(self._sidecar_path, "r+b")
+        self._sidecar_id = _file_id(self._sidecar)
+        self._read_new_rows()
+        # Drop lines past the last complete row so new rows line up with their vectors.
+        self._sidecar.truncate(self._sidecar_end)
+
+    def _sync(self):
+        """Catches up with rows other processes appended, or reloads if they rewrote or removed the files."""
+        if not self._path:
+            return
+        try:
+            stat = os.stat(self._sidecar_path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None and self._sidecar_id is None:
+            return
+        # Our open handle keeps the old inode alive, so a replaced sidecar always has a new id.
+        if stat is None or (stat.st_dev, stat.st_ino) != self._sidecar_id or stat.st_size < self._sidecar_end:
+            self._load()
+        elif stat.st_size > self._sidecar_end:
+            self._read_new_rows()
+
+    def _read_new_rows(self):
+        """Indexes the complete sidecar lines past the known end that have a vector."""
+        # A crash can leave a sidecar line without its vector, or the reverse.
+        rows = os.path.getsize(self._path) // (self.dim * 4) if os.path.exists(self._path) else 0
+        self._sidecar.seek(self._sidecar_end)
+        for line in self._sidecar:
+            if not line.endswith(b"\n") or self.size >= rows:
+                break
+            if self.size == self.capacity:
+                self._grow()
+            self._offsets[self.size] = self._sidecar_end
+            self._contexts[self.size] = self._context_code(json.loads(line).get("context"))
+            self._sidecar_end += len(line)
+            self.size += 1
+
+    def _open_memmap(self, rows):
+        with open(self._path, "ab") as handle:
+            if handle.tell() < rows * self.dim * 4:
+                handle.truncate(rows * self.dim * 4)
+        self._vectors = np.memmap(self._path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _close_files(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+
+    def _grow(self):
+        rows = max(self.capacity * 2, self.initial_capacity)
+        if self._path:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._open_memmap(rows)
+            offsets = np.zeros(rows, dtype=np.int64)
+            offsets[:self.size] = self._offsets[:self.size]
+            self._offsets = offsets
+        else:
+            grown = np.zeros((rows, self.dim), dtype=np.float32)
+            grown[:self.size] = self._vectors[:self.size]
+            self._vectors = grown
+        contexts = np.zeros(rows, dtype=np.int32)
+        contexts[:self.size] = self._contexts[:self.size]
+        self._contexts = contexts
+
+    def _drop_oldest(self, count):
+        """Removes the ``count`` oldest rows, keeping the rest in order."""
+        kept = self.size - count
+        self._vectors[:kept] = self._vectors[count:self.size]
+        self._contexts[:kept] = self._contexts[count:self.size]
+        if self._path:
+            self._vectors.flush()
+            start = int(self._offsets[count])
+            self._sidecar.seek(start)
+            self._rewrite_sidecar(self._sidecar.read(self._sidecar_end - start))
+            self._offsets[:kept] = self._offsets[count:self.size] - self._offsets[count]
+        else:
+            self._message_chars -= sum(len(exchange["message"]) for exchange in self.exchanges[:count])
+            del self.exchanges[:count]
+        self.size = kept
+
+    def _rewrite_sidecar(self, data):
+        temporary = f"{self._sidecar_path}.tmp"
+        with open(temporary, "wb") as handle:
+            handle.write(data)
+        self._sidecar.close()
+        os.replace(temporary, self._sidecar_path)
+        self._sidecar = open(self._sidecar_path, "r+b")
+        self._sidecar_id = _file_id(self._sidecar)
+        self._sidecar_end = len(data)
+
+    def clear(self):
+        """Drops every row, deleting the vector file and sidecar in directory mode."""
+        with self._locked():
+            self.size = 0
+            self.exchanges = []
+            self._message_chars = 0
+            self._context_codes = {}
+            if self._path:
+                self._close_files()
+                # Deleting rather than truncating keeps other processes' mappings valid until they reload.
+                _remove_files(self._path, self._sidecar_path)
+                self._load()
+            else:
+                self._contexts = np.zeros(self.initial_capacity, dtype=np.int32)
+                self._vectors = np.zeros((self.initial_capacity, self.dim), dtype=np.float32)
+
+    def _context_code(self, context):
+        return self._context_codes.setdefault(context, len(self._context_codes) + 1)
+
+    def _exchange(self, row):
+        if not self._path:
+            return self.exchanges[row]
+        self._sidecar.seek(int(self._offsets[row]))
+        return json.loads(self._sidecar.readline())
+
+    def add(self, exchange, context=None):
+        """Embeds an exchange and appends it to the index."""
+        with self._locked(create=True):
+            self._sync()
+            if self.max_rows and self.size >= self.max_rows:
+                self._drop_oldest(max(1, self.max_rows // 4))
+            if self.size == self.capacity:
+                self._grow()
+            record = dict(exchange, context=context) if context is not None else dict(exchange)
+            self._vectors[self.size] = self.embedder(exchange["message"])
+            self._contexts[self.size] = self._context_code(context)
+            if self._path:
+                self._append_line((json.dumps(record) + "\n").encode("utf-8"))
+            else:
+                self.exchanges.append(record)
+                self._message_chars += len(record["message"])
+            self.size += 1
+
+    def _append_line(self, line):
+        if self._sidecar is None:
+            self._sidecar = open(self._sidecar_path, "w+b")
+            self._sidecar_id = _file_id(self._sidecar)
+        self._sidecar.seek(self._sidecar_end)
+        self._sidecar.write(line)
+        # Cut off any partial line a crashed writer left, and publish the row before unlocking.
+        self._sidecar.truncate()
+        self._sidecar.flush()
+        self._offsets[self.size] = self._sidecar_end
+        self._sidecar_end += len(line)
+
+    def search(self, text, k=3, skip_newest=0, context=None, context_boost=0.05, min_score=0.0):
+        """Returns up to ``k`` (score, exchange) pairs most similar to ``text``.
+
+        The ``skip_newest`` most recent rows are not searched, which lets
+        callers skip exchanges that are already in the prompt. Rows from the
+        same ``context`` get a small score boost.
+        """
+        with self._locked():
+            self._sync()
+            rows = self.size - skip_newest
+            if rows <= 0 or k <= 0:
+                return []
+            scores = self._vectors[:rows] @ self.embedder(text)
+            if context is not None and context in self._context_codes:
+                scores = scores + context_boost * (self._contexts[:rows] == self._context_codes[context])
+            k = min(k, rows)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[row]), self._exchange(row)) for row in top if scores[row] >= min_score]
+
+    def approximate_size(self):
+        """Returns the bytes held on the heap; memory-mapped rows and the sidecar are not counted."""
+        if self._path:
+            return self._offsets.nbytes + self._contexts.nbytes
+        return self._vectors.nbytes + self._contexts.nbytes + self._message_chars
+
+    def flush(self):
+        with self._thread_lock:
+            if self._path and self._vectors is not None:
+                self._vectors.flush()
+            if self._sidecar is not None:
+                self._sidecar.flush()
+
+    def close(self):
+        """Releases the files; the next call reloads them as if another process had written."""
+        with self._thread_lock:
+            if self._path:
+                self._reset()
+            if self._lock is not None:
+                self._lock.close()
+                self._lock = None
@@ -0,0 +1,245 @@
+"""Feedback events and the tone patterns learned from them.
+
+Feedback is appended to the ``feedback_events`` table in batches. An
+aggregation job periodically re-scores the users with new events. For each
+user and context, and for each tone setting, it finds the value whose
+responses were rated best, and stores the result as the profile's
+``successful_tone_patterns``. ``MemoryManager`` loads those and
+``ToneEngine`` applies them on top of the context's tone.
+
+The job runs inside the app every ``FEEDBACK_AGGREGATE_INTERVAL`` seconds,
+or offline against the database file:
+
+    python feedback_log.py aggregate [--database tone_system.db]
+"""
+import argparse
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from database import (
+    append_feedback, db, get_feedback_events, prune_feedback, save_tone_patterns, users_with_new_feedback
+)
+from migrations import migrate_schema
+from tone_compiler import DEFAULT_TONE
+from trace_log import logger
+
+try:
+    import numpy as np
+except ImportError:  # Without NumPy feedback is still logged, but not aggregated.
+    np = None
+
+FEEDBACK_SCORES = {"positive": 1, "negative": -1}
+
+
+def learn_tone_patterns(events, now, half_life_days=30.0, min_events=5, min_success=0.6):
+    """Returns ``{user_id: {context: {setting: value}}}`` learned from feedback events.
+
+    ``events`` are ``(user_id, context, tone, score, created_at)`` rows;
+    events without a context are learned under ``""``. Each
+    event's weight halves every ``half_life_days``. For each tone setting,
+    the value with the best smoothed positive rate is kept if it was rated
+    at least ``min_events`` times and scores at least ``min_success``. All
+    counting is done with one ``bincount`` per setting over every event.
+    Users whose feedback supports no setting get an empty pattern, which
+    clears anything learned before.
+    """
+    if not events:
+        return {}
+    group_keys = np.array([f"{user_id}\0{context or ''}" for user_id, context, _, _, _ in events])
+    groups, group_codes = np.unique(group_keys, return_inverse=True)
+    ages = np.array([(now - created_at).total_seconds() for _, _, _, _, created_at in events]) / 86400.0
+    weights = 0.5 ** (np.maximum(ages, 0.0) / half_life_days)
+    positive = weights * (np.array([score for _, _, _, score, _ in events]) > 0)
+
+    patterns = {key.split("\0", 1)[0]: {} for key in groups}
+    for setting in DEFAULT_TONE:
+        values = np.array([str((tone or {}).get(setting, "")) for _, _, tone, _, _ in events])
+        labels, value_codes = np.unique(values, return_inverse=True)
+        rated = values != ""
+        cells = (group_codes * len(labels) + value_codes)[rated]
+        shape = (len(groups), len(labels))
+        counts = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)
+        totals = np.bincount(cells, weights=weights[rated], minlength=counts.size).reshape(shape)
+        successes = np.bincount(cells, weights=positive[rated], minlength=counts.size).reshape(shape)
+        # Laplace smoothing keeps a single lucky rating from winning outright.
+        rates = np.where(counts >= min_events, (successes + 1.0) / (totals + 2.0), 0.0)
+        best = rates.argmax(axis=1)
+        best_rates = rates[np.arange(len(groups)), best]
+        for group in np.nonzero(best_rates >= min_success)[0]:
+            user_id, context = groups[group].split("\0", 1)
+            patterns[user_id].setdefault(context, {})[setting] = str(labels[best[group]])
+    return patterns
+
+
+class FeedbackLog:
+    """Buffered, append-only feedback log with a periodic aggregation job.
+
+    Appends are written in one multi-row insert every ``flush_interval``
+    seconds or once ``max_pending`` events are waiting. Every
+    ``aggregate_interval`` seconds (0 disables it) the users with new events
+    get their tone patterns recomputed from their last ``retention_days``
+    of feedback, ``batch_users`` users per transaction.
+    """
+
+    def __init__(self, app=None, engine=None):
+        self.app = None
+        self.engine = engine
+        self.flush_interval = 1.0
+        self.max_pending = 1000
+        self.aggregate_interval = 60.0
+        self.batch_users = 1000
+        self.half_life_days = 30.0
+        self.min_events = 5
+        self.min_success = 0.6
+        self.retention_days = 180.0
+        # Called with the ids of users whose stored patterns changed.
+        self.on_patterns = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_aggregation = 0.0
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine=None):
+        """Reads the feedback settings from the app config."""
+        self.app = app
+        self.engine = engine or self.engine
+        self.flush_interval = float(app.config.get("FEEDBACK_FLUSH_INTERVAL", self.flush_interval))
+        self.max_pending = int(app.config.get("FEEDBACK_FLUSH_MAX_PENDING", self.max_pending))
+        self.aggregate_interval = float(app.config.get("FEEDBACK_AGGREGATE_INTERVAL", self.aggregate_interval))
+        self.half_life_days = float(app.config.get("FEEDBACK_HALF_LIFE_DAYS", self.half_life_days))
+        self.min_events = int(app.config.get("FEEDBACK_MIN_EVENTS", self.min_events))
+        self.min_success = float(app.config.get("FEEDBACK_MIN_SUCCESS", self.min_success))
+        self.retention_days = float(app.config.get("FEEDBACK_RETENTION_DAYS", self.retention_days))
+        if self.aggregate_interval and np is None:
+            logger.warning("numpy is not installed; tone patterns will not be learned from feedback.")
+            self.aggregate_interval = 0.0
+        atexit.register(self.shutdown)
+
+    def record(self, user_id, feedback, context, tone):
+        """Queues one feedback event on the tone applied in ``context``."""
+        self.record_many([(user_id, feedback, context, tone)])
+
+    def record_many(self, events):
+        """Queues ``(user_id, feedback, context, tone)`` events."""
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "context": context, "tone": dict(tone),
+             "score": FEEDBACK_SCORES[feedback], "created_at": now}
+            for user_id, feedback, context, tone in events
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._pending.extend(rows)
+            pending_count = len(self._pending)
+        self._ensure_flusher()
+        if pending_count >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_count(self):
+        """Returns the number of events not yet written."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes every pending event to the database in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            with self.app.app_context():
+                append_feedback(pending)
+        except Exception:
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+        return len(pending)
+
+    def aggregate(self):
+        """Recomputes tone patterns for every user with new feedback; returns how many users."""
+        now = datetime.utcnow()
+        since = now - timedelta(days=self.retention_days)
+        aggregated = 0
+        while True:
+            with self.engine.begin() as connection:
+                user_ids, through_id = users_with_new_feedback(connection, self.batch_users)
+                if not user_ids:
+                    prune_feedback(connection, since)
+                    return aggregated
+                events = get_feedback_events(connection, user_ids, since)
+                patterns = learn_tone_patterns(
+                    events, now, self.half_life_days, self.min_events, self.min_success
+                )
+                event_counts = {}
+                for user_id, *_ in events:
+                    event_counts[user_id] = event_counts.get(user_id, 0) + 1
+                # Users whose retained events all expired keep an empty pattern.
+                for user_id in user_ids:
+                    patterns.setdefault(user_id, {})
+                updated = save_tone_patterns(connection, patterns, through_id, event_counts)
+            if self.on_patterns is not None:
+                self.on_patterns(updated)
+            aggregated += len(user_ids)
+
+    def shutdown(self):
+        """Stops the background writer and writes out anything pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _ensure_flusher(self):
+        """Starts the background writer thread on first use."""
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._last_aggregation = time.monotonic()
+                self._thread = threading.Thread(target=self._run, name="feedback-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.aggregate_interval and time.monotonic() - self._last_aggregation >= self.aggregate_interval:
+                    self._last_aggregation = time.monotonic()
+                    self.aggregate()
+            except Exception:
+                logger.exception("Feedback log write failed, will retry")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("aggregate",))
+    parser.add_argument("--database", default="tone_system.db", help="SQLite database file")
+    parser.add_argument("--half-life-days", type=float, default=30.0)
+    parser.add_argument("--min-events", type=int, default=5)
+    parser.add_argument("--min-success", type=float, default=0.6)
+    parser.add_argument("--retention-days", type=float, default=180.0)
+    args = parser.parse_args()
+
+    if np is None:
+        parser.exit(1, "numpy is required to aggregate feedback.\n")
+    engine = create_engine(f"sqlite:///{args.database}", connect_args={"timeout": 30})
+    db.Model.metadata.create_all(engine)
+    migrate_schema(engine)
+    log = FeedbackLog(engine=engine)
+    log.half_life_days, log.min_events = args.half_life_days, args.min_events
+    log.min_success, log.retention_days = args.min_success, args.retention_days
+    started = time.monotonic()
+    users = log.aggregate()
+    print(f"Updated tone patterns for {users} users in {time.monotonic() - started:.2f}s.")
@@ -0,0 +1,356 @@
+import asyncio
+import json
+import random
+import re
+import threading
+from urllib.parse import urlsplit
+
+
+class LLMBackend:
+    """Interface for the model that turns a prompt into a response.
+
+    ``generate`` blocks the calling thread; ``agenerate`` can be awaited from
+    any event loop so many generations can be in flight per process.
+    """
+
+    def generate(self, prompt, message, tone):
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, message, tone):
+        return self.generate(prompt, message, tone)
+
+    def stream(self, prompt, message, tone):
+        """Yields the response in chunks as they become available.
+
+        Backends without native streaming yield the whole response at once.
+        """
+        yield self.generate(prompt, message, tone)
+
+    def warm_up(self, tones):
+        """Prepares for responses in these tones before traffic arrives."""
+
+    def close(self):
+        """Releases any resources held by the backend."""
+
+
+_OPENINGS = {
+    "casual": "Hey there! So, about '\0', you could probably just...",
+    "professional": "Regarding your query about '\0', the recommended course of action is...",
+    "formal": "With respect to your inquiry, '\0', it is advisable to proceed by...",
+}
+_FALLBACK_OPENING = "I'm not sure how to answer that."
+_PERSONA_LINES = {
+    "witty": " You know, a clever person might say that...",
+    "friendly": " Just a friendly thought here, but...",
+    "professional": " From a professional standpoint, it's clear that...",
+}
+_PUNS = (" That's a *punny* way to put it!", " I'm not *kitten* you, that's the answer.", " That's some *egg-cellent* logic!")
+
+
+def _template_key(formality, enthusiasm, verbosity, persona, humor):
+    """Reduces a tone to the settings that change the simulated response."""
+    return (
+        formality if formality in _OPENINGS else None,
+        enthusiasm == 'high',
+        verbosity == 'detailed',
+        persona if persona in _PERSONA_LINES else None,
+        humor == 'punny',
+    )
+
+
+def _compile_response_templates():
+    """Builds every simulated response as ``(before, after)`` text around the message.
+
+    Responses that do not quote the message have ``after`` set to None.
+    """
+    templates = {}
+    for formality in (*_OPENINGS, None):
+        for persona in (*_PERSONA_LINES, None):
+            for enthusiastic in (False, True):
+                for detailed in (False, True):
+                    for punny in (False, True):
+                        text = _OPENINGS.get(formality, _FALLBACK_OPENING)
+                        if enthusiastic:
+                            text += " It's going to be absolutely fantastic!"
+                        if detailed:
+                            text += " To elaborate further, this involves several steps starting with..."
+                        text += _PERSONA_LINES.get(persona, "")
+                        variants = [text + pun for pun in _PUNS] if punny else [text]
+                        key = (formality, enthusiastic, detailed, persona, punny)
+                        templates[key] = tuple(
+                            tuple(variant.split("\0")) if "\0" in variant else (variant, None)
+                            for variant in variants
+                        )
+    return templates
+
+
+_RESPONSE_TEMPLATES = _compile_response_templates()
+
+
+def _tone_key(tone):
+    get = tone.get
+    return (get('formality', 'casual'), get('enthusiasm'), get('verbosity'), get('persona', 'neutral'), get('humor'))
+
+
+class SimulatedBackend(LLMBackend):
+    """Offline stand-in that builds a canned response from the tone.
+
+    Every combination of tone settings is compiled to a template at import
+    time, so a response is one table lookup and one concatenation.
+    """
+
+    def generate(self, prompt, message, tone):
+        """Simulates a response from an LLM based on the tone."""
+        templates = _RESPONSE_TEMPLATES[_template_key(*_tone_key(tone))]
+        before, after = templates[0] if len(templates) == 1 else random.choice(templates)
+        return before if after is None else before + message + after
+
+    def stream(self, prompt, message, tone):
+        """Yields the simulated response one word at a time."""
+        yield from re.findall(r"\s*\S+", self.generate(prompt, message, tone))
+
+
+class BackendError(Exception):
+    """Raised when a backend cannot produce a response."""
+
+
+class _RetryableError(BackendError):
+    """A failure that may succeed on another attempt."""
+
+
+class HTTPBackend(LLMBackend):
+    """Calls a JSON-over-HTTP completion service.
+
+    The request body is ``{"prompt", "message", "tone"}`` and the reply must
+    be a JSON object whose ``response_field`` holds the text. Connections are
+    kept alive and pooled, at most ``max_concurrency`` requests are in flight,
+    failed attempts are retried with jittered exponential backoff, and if
+    ``hedge_after`` is set a second request is raced against one that has not
+    answered within that many seconds.
+
+    All I/O runs on a private event loop thread, so the backend can be used
+    from Flask worker threads and from any other event loop at once.
+    """
+
+    def __init__(self, url, timeout=30.0, max_concurrency=8, pool_size=None,
+                 max_retries=2, backoff_base=0.1, hedge_after=None,
+                 response_field="response", headers=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported LLM backend URL: {url!r}")
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.use_ssl = parts.scheme == "https"
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size or max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.hedge_after = hedge_after
+        self.response_field = response_field
+        self.headers = dict(headers or {})
+
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "hedges": 0, "failures": 0}
+        self._idle = []
+        self._loop = None
+        self._semaphore = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # --- Public API ---
+
+    def generate(self, prompt, message, tone):
+        future = asyncio.run_coroutine_threadsafe(self._generate(prompt, message, tone), self._ensure_loop())
+        return future.result()
+
+    async def agenerate(self, prompt, message, tone):
+        future = asyncio.run_coroutine_threadsafe(self._generate(prompt, message, tone), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_idle(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    # --- Event loop plumbing ---
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="llm-http-backend", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+        return self._loop
+
+    # --- Request handling ---
+
+    async def _generate(self, prompt, message, tone):
+        self.stats["requests"] += 1
+        body = json.dumps({"prompt": prompt, "message": message, "tone": tone}).encode("utf-8")
+        if self.hedge_after is None:
+            return await self._with_retries(body)
+
+        started = asyncio.Event()
+        primary = asyncio.ensure_future(self._with_retries(body, started))
+        # The hedge clock starts once the primary has a slot, so time spent queued never triggers a hedge.
+        waiting = asyncio.ensure_future(started.wait())
+        await asyncio.wait({primary, waiting}, return_when=asyncio.FIRST_COMPLETED)
+        waiting.cancel()
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+        if self._semaphore.locked():
+            # Every slot is busy: a hedge would only queue behind them and add load.
+            return await primary
+
+        self.stats["hedges"] += 1
+        hedge = asyncio.ensure_future(self._with_retries(body))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _with_retries(self, body, started=None):
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    if started is not None:
+                        started.set()
+                    self.stats["attempts"] += 1
+                    return await asyncio.wait_for(self._request(body), self.timeout)
+            except (_RetryableError, asyncio.TimeoutError, OSError) as exc:
+                if attempt >= self.max_retries:
+                    self.stats["failures"] += 1
+                    raise BackendError(f"LLM request to {self.url} failed after {attempt + 1} attempts: {exc!r}") from exc
+                self.stats["retries"] += 1
+                # Full jitter keeps retries from many workers from lining up.
+                await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+
+    async def _request(self, body):
+        reader, writer = await self._acquire()
+        reusable = False
+        try:
+            head = (
+                f"POST {self.path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: keep-alive\r\n"
+            )
+            for name, value in self.headers.items():
+                head += f"{name}: {value}\r\n"
+            writer.write(head.encode("latin-1") + b"\r\n" + body)
+            await writer.drain()
+
+            status, headers, payload = await self._read_response(reader)
+            reusable = headers.get("connection", "").lower() != "close"
+            if status == 429 or status >= 500:
+                raise _RetryableError(f"HTTP {status}")
+            if status >= 400:
+                raise BackendError(f"LLM backend returned HTTP {status}: {payload[:200]!r}")
+            try:
+                return json.loads(payload)[self.response_field]
+            except (ValueError, KeyError, TypeError) as exc:
+                raise BackendError(f"Malformed LLM backend response: {payload[:200]!r}") from exc
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            self._release(reader, writer, reusable)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            # The server closed an idle keep-alive connection.
+            raise _RetryableError("connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            payload = b"".join(chunks)
+        elif "content-length" in headers:
+            payload = await reader.readexactly(int(headers["content-length"]))
+        else:
+            headers["connection"] = "close"
+            payload = await reader.read()
+        return status, headers, payload
+
+    async def _acquire(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        ssl = True if self.use_ssl else None
+        return await asyncio.open_connection(self.host, self.port, ssl=ssl)
+
+    def _release(self, reader, writer, reusable):
+        if reusable and len(self._idle) < self.pool_size and not writer.is_closing():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _close_idle(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+def create_backend(config):
+    """Builds the LLM backend selected by the app config."""
+    kind = config.get("LLM_BACKEND", "simulated")
+    if kind == "simulated":
+        return SimulatedBackend()
+    if kind == "http":
+        return HTTPBackend(
+            config["LLM_HTTP_URL"],
+            timeout=config.get("LLM_TIMEOUT", 30.0),
+            max_concurrency=config.get("LLM_MAX_CONCURRENCY", 8),
+            max_retries=config.get("LLM_MAX_RETRIES", 2),
+            hedge_after=config.get("LLM_HEDGE_AFTER"),
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {kind!r}")
@@ -1,15 +1,111 @@
 from collections import deque
+from collections.abc import Sequence
 import json
+import sys
+import zlib
+
+from prompt_builder import PromptBuilder
+from trace_log import trace_log
+
+class Exchange:
+    """One conversation turn, stored compactly.
+
+    Roles are interned so every record shares the same few strings, and
+    messages of at least ``compress_min_chars`` characters can be kept
+    zlib-compressed. Supports ``exchange['role']``/``exchange['message']``
+    and ``dict(exchange)`` like the plain dicts it replaces.
+    """
+
+    __slots__ = ("role", "chars", "nbytes", "_payload")
+
+    def __init__(self, role, message, compress_min_chars=0):
+        self.role = sys.intern(role)
+        self.chars = len(message)
+        if compress_min_chars and self.chars >= compress_min_chars:
+            compressed = zlib.compress(message.encode("utf-8"))
+            payload = compressed if len(compressed) < len(message) else message
+        else:
+            payload = message
+        self._payload = payload
+        self.nbytes = sys.getsizeof(self) + sys.getsizeof(payload)
+
+    @property
+    def message(self):
+        payload = self._payload
+        return zlib.decompress(payload).decode("utf-8") if isinstance(payload, bytes) else payload
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "message":
+            return self.message
+        raise KeyError(key)
+
+    def keys(self):
+        return ("role", "message")
+
+    def to_dict(self):
+        return {"role": self.role, "message": self.message}
+
+    def __repr__(self):
+        return f"Exchange({self.role!r}, {self.message!r})"
+
+
+class HistoryView(Sequence):
+    """Read-only, zero-copy view of a session's short-term memory."""
+
+    __slots__ = ("_history",)
+
+    def __init__(self, history):
+        self._history = history
+
+    def __len__(self):
+        return len(self._history)
+
+    def __iter__(self):
+        return iter(self._history)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._history[i] for i in range(*index.indices(len(self._history)))]
+        return self._history[index]
+
+    def to_list(self):
+        """Returns the exchanges as plain dicts, e.g. for JSON responses."""
+        return [exchange.to_dict() for exchange in self._history]
+
 
 class MemoryManager:
     """Manages a user's short-term and long-term memory."""
 
-    def __init__(self, user_id, profile):
+    def __init__(self, user_id, profile, max_history_chars=8000, embedding_index=None, recall_k=3, recall_min_score=0.2,
+                 max_history_bytes=None, compress_min_chars=0):
         self.user_id = user_id
         self.profile = profile
-        self.short_term_memory = deque(maxlen=20) 
-        self.tone_patterns = {} 
+        # Recent Exchange records, trimmed oldest-first once their messages exceed
+        # max_history_chars or the records exceed max_history_bytes.
+        self.short_term_memory = deque()
+        self.max_history_chars = max_history_chars
+        self.max_history_bytes = max_history_bytes
+        self.compress_min_chars = compress_min_chars
+        self.history_chars = 0
+        self.history_bytes = 0
+        self.appended_count = 0
+        self.generation = 0
+        self.prompt_builder = PromptBuilder(max_chars=max_history_chars)
+        # Learned tone settings per context, from the profile's successful_tone_patterns.
+        self.tone_patterns = {}
+        # (context, tone) of the last generated response, so feedback on it can be logged.
+        self.last_applied = None
         self.context_embeddings = {} 
+        # Optional EmbeddingIndex of every exchange, used to recall older turns.
+        self.embedding_index = embedding_index
+        self.recall_k = recall_k
+        self.recall_min_score = recall_min_score
+        # Version of the shared session state this copy reflects (see session_store).
+        self.session_version = 0
+        # Number of times the conversation was cleared, as recorded in the shared session.
+        self.clears = 0
         self._load_long_term_memory()
 
     def _load_long_term_memory(self):
@@ -17,27 +113,123 @@ class MemoryManager:
         if self.profile and 'interaction_history' in self.profile:
             self.tone_patterns = self.profile.get('successful_tone_patterns', {})
 
-    def add_to_short_term_memory(self, exchange):
+    def set_profile(self, profile):
+        """Switches to a newer copy of the user's profile and reloads its learned patterns."""
+        self.profile = profile
+        self._load_long_term_memory()
+
+    def add_to_short_term_memory(self, exchange, context=None):
         """Adds a conversation exchange to short-term memory."""
-        self.short_term_memory.append(exchange)
+        self._append(exchange)
+        if self.embedding_index is not None:
+            self.embedding_index.add(exchange, context)
+
+    def hydrate(self, exchanges):
+        """Restores persisted exchanges into short-term memory without re-indexing them."""
+        for exchange in exchanges:
+            self._append(exchange)
+
+    def restore(self, state, version):
+        """Replaces short-term memory with a snapshot from the shared session store.
+
+        If another worker cleared the conversation since the last snapshot,
+        an in-memory recall index is emptied too.
+        """
+        state = state or {}
+        clears = state.get("clears", 0)
+        if clears != self.clears:
+            # A new session adopts the count: there is nothing here from before the clear. A shared
+            # index on disk was already emptied by the worker that cleared it.
+            if self.session_version and self.embedding_index is not None and not self.embedding_index.shared:
+                self.embedding_index.clear()
+            self.clears = clears
+        self.clear_short_term_memory()
+        self.hydrate(state.get("short_term_memory", []))
+        self.session_version = version
+
+    def _append(self, exchange):
+        record = Exchange(exchange["role"], exchange["message"], self.compress_min_chars)
+        self.short_term_memory.append(record)
+        self.history_chars += record.chars
+        self.history_bytes += record.nbytes
+        self.appended_count += 1
+        while len(self.short_term_memory) > 1 and (
+            self.history_chars > self.max_history_chars
+            or (self.max_history_bytes and self.history_bytes > self.max_history_bytes)
+        ):
+            oldest = self.short_term_memory.popleft()
+            self.history_chars -= oldest.chars
+            self.history_bytes -= oldest.nbytes
+
+    def recall(self, message, context=None):
+        """Returns older exchanges relevant to ``message``, most similar first.
+
+        Exchanges still in short-term memory are the newest rows of the
+        index and are skipped, since they are already part of the prompt.
+        """
+        if self.embedding_index is None:
+            return []
+        matches = self.embedding_index.search(
+            message, k=self.recall_k, skip_newest=len(self.short_term_memory), context=context,
+            min_score=self.recall_min_score,
+        )
+        return [exchange for _, exchange in matches]
 
     def get_conversation_history(self):
-        """Returns the recent conversation history."""
-        return list(self.short_term_memory)
+        """Returns a read-only view of the recent conversation history."""
+        return HistoryView(self.short_term_memory)
+
+    def footprint(self):
+        """Reports the approximate bytes held by this session, by component."""
+        report = {
+            "exchanges": len(self.short_term_memory),
+            "history_chars": self.history_chars,
+            "history_bytes": sys.getsizeof(self.short_term_memory) + self.history_bytes,
+            "prompt_cache_bytes": self.prompt_builder.approximate_size(),
+            "embedding_index_bytes": self.embedding_index.approximate_size() if self.embedding_index is not None else 0,
+        }
+        report["total_bytes"] = report["history_bytes"] + report["prompt_cache_bytes"] + report["embedding_index_bytes"]
+        return report
+
+    def approximate_size(self):
+        """Returns a rough estimate of the bytes held by this session."""
+        return self.footprint()["total_bytes"]
 
     def clear_short_term_memory(self):
         """Clears the short-term memory buffer."""
         self.short_term_memory.clear()
+        self.history_chars = 0
+        self.history_bytes = 0
+        self.generation += 1
+
+    def forget(self):
+        """Clears the conversation: short-term memory and every exchange that could be recalled."""
+        self.clear_short_term_memory()
+        if self.embedding_index is not None:
+            self.embedding_index.clear()
+        self.clears += 1
 
     def update_tone_pattern(self, context, tone):
         """Updates a successful tone pattern for a given context."""
         self.tone_patterns[context] = tone
-        print(f"Updated tone pattern for {context}: {tone}")
+        trace_log.event("tone_pattern", user_id=self.user_id, context=context, tone=tone)
 
     def get_context_embedding(self, context):
-        """Retrieves a stored embedding for a context."""
+        """Retrieves a stored embedding for a context, embedding it locally if needed."""
+        if context not in self.context_embeddings and self.embedding_index is not None:
+            self.context_embeddings[context] = self.embedding_index.embedder(context)
         return self.context_embeddings.get(context)
 
     def update_context_embedding(self, context, vector):
         """Updates or adds a context embedding."""
-        self.context_embeddings[context] = vector
\ No newline at end of file
+        self.context_embeddings[context] = vector
+
+    def flush(self):
+        """Writes out on-disk state; the files stay open for requests still using this session."""
+        if self.embedding_index is not None:
+            self.embedding_index.flush()
+
+    def close(self):
+        """Flushes and releases any on-disk state held by this session."""
+        if self.embedding_index is not None:
+            self.embedding_index.close()
\ No newline at end of file
@@ -0,0 +1,240 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow LLM calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Prompt size buckets in characters.
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        samples = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, cumulative, ("le", _format_value(bound))))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Gauge:
+    """A value read from a callback at scrape time.
+
+    The callback returns a number, or a dict mapping label tuples to numbers.
+    Use ``kind="counter"`` for totals kept elsewhere, such as cache stats.
+    """
+
+    def __init__(self, name, help_text, callback, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, value) for key, value in values.items()]
+
+
+class _Span:
+    __slots__ = ("histogram", "stage", "start")
+
+    def __init__(self, histogram, stage):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Metrics:
+    """Process-wide metrics registry exposed in Prometheus text format.
+
+    When disabled, ``span`` returns a shared no-op context manager and the
+    record helpers return immediately, so instrumentation costs one
+    attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics = {}
+        self.stage_seconds = self.histogram("tone_stage_seconds", "Time spent in each stage of handling a request.")
+        self.request_seconds = self.histogram("tone_request_seconds", "HTTP request latency by endpoint.")
+        self.prompt_chars = self.histogram("tone_prompt_chars", "Size of generated prompts in characters.", SIZE_BUCKETS)
+        self.db_queries = self.counter("tone_db_queries_total", "SQL statements sent to the database.")
+        self.admission_wait_seconds = self.histogram(
+            "tone_admission_wait_seconds", "Time requests waited in the admission queue before running."
+        )
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, callback, kind="gauge"):
+        return self._register(Gauge(name, help_text, callback, kind))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def span(self, stage):
+        """Times a block of code as one stage of request handling."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self.stage_seconds, stage)
+
+    def observe_prompt(self, size):
+        if self.enabled:
+            self.prompt_chars.observe(size)
+
+    def observe_admission_wait(self, seconds):
+        if self.enabled:
+            self.admission_wait_seconds.observe(seconds)
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in metric.samples():
+                name, key, value = sample[:3]
+                extra = sample[3] if len(sample) > 3 else None
+                lines.append(f"{name}{_format_labels(key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def init_app(self, app, write_engine=None, read_engine=None):
+        """Adds request timing, DB query counting and the /metrics route."""
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        if not self.enabled:
+            return
+
+        from sqlalchemy import event
+
+        engines = {"write": write_engine}
+        if read_engine is not write_engine:
+            engines["read"] = read_engine
+        for role, engine in engines.items():
+            if engine is None:
+                continue
+
+            def count_query(conn, cursor, statement, parameters, context, executemany, role=role):
+                self.db_queries.inc(engine=role)
+
+            event.listen(engine, "before_cursor_execute", count_query)
+
+        @app.before_request
+        def start_request_timer():
+            g._metrics_start = time.perf_counter()
+
+        @app.after_request
+        def record_request_time(response):
+            start = g.pop("_metrics_start", None)
+            if start is not None:
+                endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+                self.request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+            return response
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics_endpoint():
+            """Prometheus scrape endpoint."""
+            return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Shared registry, initialised with the app like the SQLAlchemy instance.
+metrics = Metrics()
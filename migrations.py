@@ -0,0 +1,112 @@
+"""In-place schema migrations for tone_system.db.
+
+The schema version is kept in SQLite's ``PRAGMA user_version``:
+
+* 0: every profile lives in the ``users.profile_data`` JSON column.
+* 1: counters and ``last_interaction`` are columns on ``users`` and
+  preferences are rows in ``user_preferences``.
+* 2: ``users.version`` counts writes so cached profiles can be validated.
+
+Run ``python migrations.py [path/to/tone_system.db]`` to migrate a database
+file by hand; the app also migrates on startup.
+"""
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, text
+
+from database import COUNTER_FIELDS, PREFERENCE_SECTIONS, UserPreference
+
+SCHEMA_VERSION = 2
+
+_USER_COLUMNS = {
+    'total_interactions': "INTEGER NOT NULL DEFAULT 0",
+    'successful_tone_matches': "INTEGER NOT NULL DEFAULT 0",
+    'feedback_score': "INTEGER NOT NULL DEFAULT 0",
+    'last_interaction': "DATETIME",
+}
+
+
+def _schema_version(connection):
+    if connection.dialect.name != 'sqlite':
+        return None
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def _migrate_to_normalized(connection):
+    """Moves counters and preferences out of the profile_data JSON blob."""
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    for name, ddl in _USER_COLUMNS.items():
+        if name not in columns:
+            connection.execute(text(f"ALTER TABLE users ADD COLUMN {name} {ddl}"))
+    UserPreference.__table__.create(connection, checkfirst=True)
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_users_last_interaction ON users (last_interaction)"))
+
+    rows = connection.execute(text("SELECT user_id, profile_data FROM users")).fetchall()
+    for user_id, raw in rows:
+        profile = json.loads(raw) if isinstance(raw, str) else (raw or {})
+        history = profile.get('interaction_history') or {}
+
+        last_interaction = history.get('last_interaction')
+        try:
+            # Match the format SQLAlchemy uses for DateTime columns on SQLite.
+            last_interaction = datetime.fromisoformat(last_interaction).strftime('%Y-%m-%d %H:%M:%S.%f') if last_interaction else None
+        except ValueError:
+            last_interaction = None
+
+        preferences = []
+        for section in PREFERENCE_SECTIONS:
+            for position, (name, value) in enumerate((profile.get(section) or {}).items()):
+                preferences.append({
+                    'user_id': user_id, 'section': section, 'name': name,
+                    'value': json.dumps(value), 'position': position,
+                })
+        if preferences:
+            connection.execute(text(
+                "INSERT OR REPLACE INTO user_preferences (user_id, section, name, value, position) "
+                "VALUES (:user_id, :section, :name, :value, :position)"
+            ), preferences)
+
+        extra = {key: value for key, value in profile.items() if key not in ('user_id', 'interaction_history') + PREFERENCE_SECTIONS}
+        remaining_history = {key: value for key, value in history.items() if key not in COUNTER_FIELDS + ('last_interaction',)}
+        if remaining_history:
+            extra['interaction_history'] = remaining_history
+
+        params = {field: history.get(field, 0) or 0 for field in COUNTER_FIELDS}
+        params.update(user_id=user_id, profile_data=json.dumps(extra), last_interaction=last_interaction)
+        connection.execute(text(
+            "UPDATE users SET total_interactions = :total_interactions, "
+            "successful_tone_matches = :successful_tone_matches, feedback_score = :feedback_score, "
+            "last_interaction = :last_interaction, profile_data = :profile_data WHERE user_id = :user_id"
+        ), params)
+
+
+def _add_user_versions(connection):
+    """Adds the version column used to detect stale cached profiles."""
+    columns = {column['name'] for column in inspect(connection).get_columns('users')}
+    if 'version' not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+
+def migrate_schema(engine):
+    """Brings an existing database up to the current schema version.
+
+    Safe to call on every startup: an up-to-date database is detected from
+    its version number without touching any rows.
+    """
+    with engine.begin() as connection:
+        version = _schema_version(connection)
+        if version is None or version >= SCHEMA_VERSION:
+            return
+        if version < 1:
+            _migrate_to_normalized(connection)
+        if version < 2:
+            _add_user_versions(connection)
+        connection.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'tone_system.db'
+    migrate_schema(create_engine(f"sqlite:///{path}"))
+    print(f"{path} is at schema version {SCHEMA_VERSION}.")
@@ -0,0 +1,299 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from database import (
+    apply_profile_updates, create_user, get_recent_user_records, get_user_record, get_user_records,
+    get_user_versions, update_user
+)
+from session_cache import SessionCache
+from storage import read_session
+from tone_engine import FEEDBACK_DELTAS
+from trace_log import logger
+
+WRITE_MODE_IMMEDIATE = "immediate"
+WRITE_MODE_BATCHED = "batched"
+
+
+def _copy_profile(profile):
+    """Copies a profile and its nested sections, which turns update in place."""
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in profile.items()}
+
+
+class ProfileStore:
+    """Write-behind persistence layer for user profiles.
+
+    In ``immediate`` mode every recorded interaction is committed before the
+    request returns. In ``batched`` mode dirty profiles are kept in memory,
+    their counters are merged, and everything is flushed in one transaction
+    every ``flush_interval`` seconds, as soon as ``max_pending`` users are
+    dirty, or when the process shuts down.
+
+    Reads go through an LRU cache of ``[profile, version, loaded_at]``
+    entries. Entries older than ``cache_ttl`` are reloaded, and with
+    ``cache_validate`` every hit is checked against the ``users.version``
+    column, so writes made by other processes are noticed. Writes made
+    through this store bump the cached version themselves.
+
+    Readers get their own copy of a profile, so changes made during a turn
+    that then fails never reach the cache or the pending batch.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = WRITE_MODE_IMMEDIATE
+        self.flush_interval = 1.0
+        self.max_pending = 256
+        self.cache = None
+        self.cache_ttl = None
+        self.cache_validate = False
+        self.stale = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Reads the write-behind settings from the app config."""
+        self.app = app
+        self.mode = app.config.get("PROFILE_WRITE_MODE", WRITE_MODE_IMMEDIATE)
+        if self.mode not in (WRITE_MODE_IMMEDIATE, WRITE_MODE_BATCHED):
+            raise ValueError(f"Unknown PROFILE_WRITE_MODE: {self.mode!r}")
+        self.flush_interval = float(app.config.get("PROFILE_FLUSH_INTERVAL", self.flush_interval))
+        self.max_pending = int(app.config.get("PROFILE_FLUSH_MAX_PENDING", self.max_pending))
+        max_entries = int(app.config.get("PROFILE_CACHE_MAX_ENTRIES", 10000))
+        self.cache = SessionCache(max_entries=max_entries) if max_entries else None
+        self.cache_ttl = app.config.get("PROFILE_CACHE_TTL") or None
+        self.cache_validate = app.config.get("PROFILE_CACHE_VALIDATE", False)
+        if self.mode == WRITE_MODE_BATCHED:
+            atexit.register(self.shutdown)
+
+    def get(self, user_id, read_only=False):
+        """Returns a user's profile, preferring a pending or cached copy.
+
+        ``read_only`` lookups go through the read-only session so they never
+        wait behind writers.
+        """
+        with self._lock:
+            entry = self._pending.get(user_id)
+        if entry is not None:
+            return _copy_profile(entry["profile"])
+        session = read_session if read_only else None
+        cached = self._cached([user_id], session)
+        if user_id in cached:
+            return _copy_profile(cached[user_id])
+        profile, version = get_user_record(user_id, session=session)
+        if profile is not None and self.cache is not None:
+            self.cache.put(user_id, [profile, version, time.monotonic()])
+            profile = _copy_profile(profile)
+        return profile
+
+    def get_many(self, user_ids):
+        """Returns profiles for several users, loading missing ones in one query."""
+        profiles = {}
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._pending.get(user_id)
+                if entry is not None:
+                    profiles[user_id] = entry["profile"]
+        profiles.update(self._cached([user_id for user_id in user_ids if user_id not in profiles]))
+        missing = [user_id for user_id in user_ids if user_id not in profiles]
+        now = time.monotonic()
+        for user_id, (profile, version) in get_user_records(missing).items():
+            profiles[user_id] = profile
+            if self.cache is not None:
+                self.cache.put(user_id, [profile, version, now])
+        return {user_id: _copy_profile(profile) for user_id, profile in profiles.items()}
+
+    def preload(self, limit):
+        """Caches the profiles of the ``limit`` most recently active users and returns them."""
+        if self.cache is None or limit <= 0:
+            return []
+        now = time.monotonic()
+        records = get_recent_user_records(limit)
+        for user_id, (profile, version) in records.items():
+            self.cache.put(user_id, [profile, version, now])
+        return [profile for profile, _ in records.values()]
+
+    def create(self, profile):
+        """Creates a user and drops any cached copy."""
+        create_user(profile)
+        self._replace_pending(profile['user_id'], profile)
+        self.invalidate(profile['user_id'])
+
+    def update(self, user_id, profile):
+        """Saves a changed profile with ``update_user`` and drops the cached copy."""
+        update_user(user_id, profile)
+        self._replace_pending(user_id, profile)
+        self.invalidate(user_id)
+
+    def _replace_pending(self, user_id, profile):
+        """Makes a pending entry serve the profile just written; its counter deltas still apply."""
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is not None:
+                entry["profile"] = _copy_profile(profile)
+
+    def invalidate(self, user_id):
+        """Forgets the cached profile for a user."""
+        if self.cache is not None:
+            self.cache.pop(user_id)
+
+    def cache_stats(self):
+        """Returns profile cache counters; stale hits count as misses in the hit rate."""
+        if self.cache is None:
+            return {"enabled": False}
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            enabled=True, ttl=self.cache_ttl, validate=self.cache_validate, stale=self.stale,
+            hit_rate=(stats["hits"] - self.stale) / lookups if lookups else 0.0,
+        )
+        return stats
+
+    def _cached(self, user_ids, session=None):
+        """Returns the fresh cached profiles among ``user_ids``."""
+        if self.cache is None or not user_ids:
+            return {}
+        now = time.monotonic()
+        found = {}
+        for user_id in user_ids:
+            entry = self.cache.get(user_id)
+            if entry is None:
+                continue
+            if self.cache_ttl and now - entry[2] > self.cache_ttl:
+                self._drop_stale(user_id)
+                continue
+            found[user_id] = entry
+        if self.cache_validate and found:
+            versions = get_user_versions(list(found), session=session)
+            for user_id, entry in list(found.items()):
+                if versions.get(user_id) != entry[1]:
+                    self._drop_stale(user_id)
+                    del found[user_id]
+        return {user_id: entry[0] for user_id, entry in found.items()}
+
+    def _drop_stale(self, user_id):
+        self.stale += 1
+        self.cache.pop(user_id)
+
+    def _written(self, updates):
+        """Records that each user in ``updates`` was written once, bumping its cached version."""
+        if self.cache is None:
+            return
+        for user_id, (profile, _, _) in updates.items():
+            entry = self.cache.peek(user_id)
+            if entry is not None:
+                entry[0] = profile
+                entry[1] += 1
+
+    def record_interaction(self, user_id, profile, feedback=None):
+        """Records one interaction (and optional feedback) for a user.
+
+        The caller's ``profile`` is updated in place the same way
+        ``update_user`` does, so it stays usable as the current view.
+        """
+        self.record_interactions([(user_id, profile, feedback)])
+
+    def record_interactions(self, interactions):
+        """Records many ``(user_id, profile, feedback)`` interactions at once.
+
+        In ``immediate`` mode they are committed in a single transaction.
+        """
+        if not interactions:
+            return
+        now = datetime.utcnow().isoformat()
+        updates = {}
+        for user_id, profile, feedback in interactions:
+            history = profile.setdefault('interaction_history', {})
+            history['last_interaction'] = now
+            history['total_interactions'] = history.get('total_interactions', 0) + 1
+
+            _, deltas, _ = updates.setdefault(user_id, (profile, {}, now))
+            deltas["total_interactions"] = deltas.get("total_interactions", 0) + 1
+            for key, delta in FEEDBACK_DELTAS.get(feedback, {}).items():
+                deltas[key] = deltas.get(key, 0) + delta
+            updates[user_id] = (profile, deltas, now)
+
+        if self.mode == WRITE_MODE_IMMEDIATE:
+            apply_profile_updates(updates)
+            self._written(updates)
+            return
+
+        with self._lock:
+            for user_id, (profile, deltas, _) in updates.items():
+                entry = self._pending.setdefault(user_id, {"deltas": {}})
+                entry["profile"] = profile
+                entry["last_interaction"] = now
+                for key, delta in deltas.items():
+                    entry["deltas"][key] = entry["deltas"].get(key, 0) + delta
+            pending_count = len(self._pending)
+        self._ensure_flusher()
+        if pending_count >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_count(self):
+        """Returns the number of users with unflushed changes."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes every pending profile to the database in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        updates = {
+            user_id: (entry["profile"], entry["deltas"], entry["last_interaction"])
+            for user_id, entry in pending.items()
+        }
+        try:
+            with self.app.app_context():
+                apply_profile_updates(updates)
+        except Exception:
+            self._requeue(pending)
+            raise
+        self._written(updates)
+        return len(updates)
+
+    def shutdown(self):
+        """Stops the background flusher and writes out anything pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _requeue(self, pending):
+        """Merges a failed batch back into the pending set."""
+        with self._lock:
+            for user_id, entry in pending.items():
+                current = self._pending.get(user_id)
+                if current is None:
+                    self._pending[user_id] = entry
+                    continue
+                for key, delta in entry["deltas"].items():
+                    current["deltas"][key] = current["deltas"].get(key, 0) + delta
+
+    def _ensure_flusher(self):
+        """Starts the background flusher thread on first use."""
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Profile flush failed, will retry")
@@ -0,0 +1,142 @@
+"""Bulk import and export of user profiles as NDJSON.
+
+One profile per line, in the shape returned by ``GET /api/profile/<user_id>``,
+so an export can be imported again unchanged. Imports are written in
+chunks, each chunk one transaction of a fixed number of statements, and
+only the current chunk is held in memory. Exports read through a
+server-side cursor.
+
+    python profile_transfer.py export [--database tone_system.db] > profiles.ndjson
+    python profile_transfer.py import profiles.ndjson [--database tone_system.db]
+
+The running app exposes the same operations as ``GET /api/profiles/export``
+and ``POST /api/profiles/import``.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import COUNTER_FIELDS, PREFERENCE_SECTIONS, db, iter_profiles, upsert_profiles
+from migrations import migrate_schema
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def validate_profile(record):
+    """Checks one imported record; raises ValueError describing the first problem."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    user_id = record.get('user_id')
+    if not isinstance(user_id, str) or not user_id:
+        raise ValueError("user_id must be a non-empty string")
+    for section in PREFERENCE_SECTIONS + ('interaction_history',):
+        if section in record and not isinstance(record[section], (dict, type(None))):
+            raise ValueError(f"{section} must be an object")
+    history = record.get('interaction_history') or {}
+    for field in COUNTER_FIELDS:
+        if field in history and (not isinstance(history[field], int) or isinstance(history[field], bool)):
+            raise ValueError(f"interaction_history.{field} must be an integer")
+    last_interaction = history.get('last_interaction')
+    if last_interaction is not None:
+        try:
+            datetime.fromisoformat(last_interaction)
+        except (TypeError, ValueError):
+            raise ValueError("interaction_history.last_interaction must be an ISO timestamp") from None
+    return record
+
+
+def import_profiles(engine, lines, chunk_size=DEFAULT_CHUNK_SIZE, on_commit=None):
+    """Upserts NDJSON profile lines and yields progress events as it goes.
+
+    Events are dicts with an ``event`` key: ``error`` for each record that
+    was rejected (with its line number), ``progress`` after each committed
+    chunk, and a final ``done`` with the totals. If a chunk fails to write,
+    its records are retried one at a time so one bad record does not reject
+    the rest. ``on_commit`` is called with the user ids of every committed
+    chunk. When a user_id appears twice in a chunk, the later line wins.
+    """
+    started = time.monotonic()
+    totals = {"processed": 0, "created": 0, "updated": 0, "failed": 0}
+    chunk = {}
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        totals["processed"] += 1
+        try:
+            record = validate_profile(json.loads(line))
+        except ValueError as exc:
+            totals["failed"] += 1
+            yield {"event": "error", "line": line_number, "error": str(exc)}
+            continue
+        chunk.pop(record['user_id'], None)
+        chunk[record['user_id']] = (line_number, record)
+        if len(chunk) >= chunk_size:
+            yield from _write_chunk(engine, chunk, totals, on_commit)
+            chunk = {}
+    if chunk:
+        yield from _write_chunk(engine, chunk, totals, on_commit)
+    yield dict(totals, event="done", seconds=round(time.monotonic() - started, 3))
+
+
+def _write_chunk(engine, chunk, totals, on_commit):
+    try:
+        with engine.begin() as connection:
+            created, updated = upsert_profiles(connection, [record for _, record in chunk.values()])
+    except SQLAlchemyError as exc:
+        if len(chunk) == 1:
+            (line_number, record), = chunk.values()
+            totals["failed"] += 1
+            yield {"event": "error", "line": line_number, "user_id": record['user_id'],
+                   "error": str(getattr(exc, "orig", None) or exc)}
+            return
+        for user_id, item in chunk.items():
+            yield from _write_chunk(engine, {user_id: item}, totals, on_commit)
+        return
+    totals["created"] += len(created)
+    totals["updated"] += len(updated)
+    if on_commit is not None:
+        on_commit(created + updated)
+    yield dict(totals, event="progress")
+
+
+def export_profiles(engine, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields every profile as an NDJSON line."""
+    with engine.connect() as connection:
+        for profiles in iter_profiles(connection, chunk_size):
+            for profile in profiles:
+                yield json.dumps(profile) + "\n"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file", nargs="?", default="-", help="NDJSON file to read or write (default: stdin/stdout)")
+    parser.add_argument("--database", default="tone_system.db", help="SQLite database file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    # Wait for a running app to finish its writes rather than failing.
+    engine = create_engine(f"sqlite:///{args.database}", connect_args={"timeout": 30})
+    db.Model.metadata.create_all(engine)
+    migrate_schema(engine)
+
+    if args.command == "export":
+        output = sys.stdout if args.file == "-" else open(args.file, "w", encoding="utf-8")
+        with output:
+            output.writelines(export_profiles(engine, args.chunk_size))
+    else:
+        source = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+        with source:
+            for event in import_profiles(engine, source, args.chunk_size):
+                if event["event"] == "error":
+                    print(json.dumps(event), file=sys.stderr)
+                elif event["event"] == "progress":
+                    print(f"{event['processed']} processed, {event['created']} created, "
+                          f"{event['updated']} updated, {event['failed']} failed", file=sys.stderr)
+                else:
+                    print(json.dumps(event))
@@ -0,0 +1,109 @@
+import json
+import sys
+from collections import deque
+from functools import lru_cache
+
+# Rough characters-per-token ratio used to report an approximate token count.
+CHARS_PER_TOKEN = 4
+# Introduces older exchanges recalled from the embedding index.
+RECALL_HEADER = "Relevant earlier conversation:\n"
+
+
+@lru_cache(maxsize=1024)
+def _system_prefix(tone_items, context, technical_level):
+    """Renders the static part of the prompt for a tone/context pair."""
+    prompt = f"You are a helpful assistant. Your current user prefers the following tone: {json.dumps(dict(tone_items))}. "
+    prompt += f"The conversation context is '{context}'. The user's technical level is '{technical_level}'.\n\n"
+    return prompt
+
+
+def render_exchange(exchange):
+    """Renders one history exchange as a prompt line."""
+    return f"{exchange['role'].capitalize()}: {exchange['message']}\n"
+
+
+class PromptBuilder:
+    """Incrementally assembles prompts for one user's conversation.
+
+    History lines are rendered once, when an exchange is first seen, and
+    reused on later turns. The system prefix is cached per tone, context and
+    technical level. Recalled older exchanges may use up to a quarter of the
+    budget. When the prompt would exceed ``max_chars`` the oldest history
+    lines are left out.
+    """
+
+    def __init__(self, max_chars=8000):
+        self.max_chars = max_chars
+        self._lines = deque()
+        self._bytes = 0
+        self._synced = 0
+        self._generation = None
+        self.last_stats = None
+
+    def _sync(self, memory):
+        """Renders exchanges appended to ``memory`` since the last build."""
+        history = memory.short_term_memory
+        new = memory.appended_count - self._synced
+        if memory.generation != self._generation or new > len(history):
+            self._lines = deque(render_exchange(exchange) for exchange in history)
+            self._bytes = sum(sys.getsizeof(line) for line in self._lines)
+        elif new:
+            start = len(history) - new
+            for index in range(start, len(history)):
+                line = render_exchange(history[index])
+                self._lines.append(line)
+                self._bytes += sys.getsizeof(line)
+        while len(self._lines) > len(history):
+            self._bytes -= sys.getsizeof(self._lines.popleft())
+        self._synced = memory.appended_count
+        self._generation = memory.generation
+
+    def build(self, memory, tone, context, technical_level, message, recalled=()):
+        """Returns the prompt for ``message`` and records its size."""
+        self._sync(memory)
+        try:
+            prefix = _system_prefix(tuple(tone.items()), context, technical_level)
+        except TypeError:
+            # Unhashable preference values cannot be cached; render directly.
+            prefix = _system_prefix.__wrapped__(tuple(tone.items()), context, technical_level)
+        tail = f"User: {message}\nAssistant:"
+
+        budget = self.max_chars - len(prefix) - len(tail)
+        recall_lines = []
+        recall_budget = budget // 4 - len(RECALL_HEADER) - 1
+        for exchange in recalled:
+            line = render_exchange(exchange)
+            if len(line) > recall_budget:
+                break
+            recall_budget -= len(line)
+            recall_lines.append(line)
+        if recall_lines:
+            recall_lines = [RECALL_HEADER, *recall_lines, "\n"]
+            budget -= sum(len(line) for line in recall_lines)
+
+        kept = 0
+        used = 0
+        for line in reversed(self._lines):
+            if used + len(line) > budget:
+                break
+            used += len(line)
+            kept += 1
+
+        if kept == len(self._lines):
+            history = self._lines
+        else:
+            history = list(self._lines)[len(self._lines) - kept:]
+        prompt = "".join([prefix, *recall_lines, *history, tail])
+
+        self.last_stats = {
+            "chars": len(prompt),
+            "approx_tokens": len(prompt) // CHARS_PER_TOKEN,
+            "history_turns": kept,
+            "trimmed_turns": len(self._lines) - kept,
+            "recalled_turns": max(0, len(recall_lines) - 2),
+        }
+        return prompt
+
+    def approximate_size(self):
+        """Returns a rough estimate of the bytes held by cached lines."""
+        return self._bytes
@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict
+
+from trace_log import logger
+
+
+class SessionCache:
+    """A bounded LRU cache for per-user sessions with an idle TTL.
+
+    Entries are evicted least-recently-used first when ``max_entries`` or
+    ``max_bytes`` is exceeded, and any entry idle for longer than
+    ``idle_ttl`` seconds is dropped. A limit of ``0`` or ``None`` disables
+    it. ``on_evict(key, value, reason)`` is called for every evicted entry
+    so callers can persist it; it runs after the cache lock is released, so
+    slow hooks do not hold up other lookups. Sizes are measured with
+    ``sizeof(value)`` on ``put`` and ``refresh``, not on reads.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None, idle_ttl=None, on_evict=None, sizeof=None, clock=time.monotonic):
+        self.max_entries = max_entries or None
+        self.max_bytes = max_bytes or None
+        self.idle_ttl = idle_ttl or None
+        self.on_evict = on_evict
+        self.sizeof = sizeof or (lambda value: 0)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries and not self._is_expired(self._entries[key])
+
+    def peek(self, key):
+        """Returns a cached value without updating recency or stats."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry):
+                return None
+            return entry[0]
+
+    def get(self, key):
+        """Returns a cached value and marks it as recently used."""
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                self._evict(key, "expired", evicted)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._mark_used(key, entry)
+        self._notify(evicted)
+        return entry[0] if entry is not None else None
+
+    def get_or_create(self, key, factory):
+        """Returns the cached value for ``key``, creating it on a miss."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        # Build outside the lock so a slow factory does not stall other users.
+        value = factory()
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_expired(entry):
+                self._mark_used(key, entry)
+                return entry[0]
+            self._touch(key, value)
+            self._enforce_limits(evicted)
+        self._notify(evicted)
+        return value
+
+    def put(self, key, value):
+        """Inserts or replaces an entry and enforces the cache limits."""
+        evicted = []
+        with self._lock:
+            self._touch(key, value)
+            self._enforce_limits(evicted)
+        self._notify(evicted)
+
+    def refresh(self, key):
+        """Re-measures an entry after its value has grown or shrunk."""
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._touch(key, entry[0])
+                self._enforce_limits(evicted)
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        """Removes an entry without calling the eviction hook."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._total_bytes -= entry[2]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def values(self):
+        with self._lock:
+            return [entry[0] for entry in self._entries.values()]
+
+    def stats(self):
+        """Returns counters that help size the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _mark_used(self, key, entry):
+        # Reads keep the size measured by the last put() or refresh().
+        self._entries[key] = (entry[0], self._clock(), entry[2])
+        self._entries.move_to_end(key)
+
+    def _touch(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old[2]
+        size = self.sizeof(value)
+        self._entries[key] = (value, self._clock(), size)
+        self._total_bytes += size
+
+    def _is_expired(self, entry):
+        return self.idle_ttl is not None and self._clock() - entry[1] > self.idle_ttl
+
+    def _enforce_limits(self, evicted):
+        # Entries are ordered by last access, so expired ones sit at the front.
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if self._is_expired(entry):
+                self._evict(key, "expired", evicted)
+            elif self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._evict(key, "capacity", evicted)
+            elif self.max_bytes is not None and self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict(key, "capacity", evicted)
+            else:
+                break
+
+    def _evict(self, key, reason, evicted):
+        """Removes an entry under the lock; ``_notify`` later runs the hook for it."""
+        value, _, size = self._entries.pop(key)
+        self._total_bytes -= size
+        if reason == "expired":
+            self.expirations += 1
+        else:
+            self.evictions += 1
+        evicted.append((key, value, reason))
+
+    def _notify(self, evicted):
+        if self.on_evict is None:
+            return
+        for key, value, reason in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception:
+                logger.exception("Session eviction hook failed for %s", key)
@@ -0,0 +1,295 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class SessionConflictError(Exception):
+    """Raised when a session update keeps losing to concurrent writers."""
+
+
+def append_exchanges(state, exchanges, max_chars):
+    """Returns ``state`` with exchanges appended and old ones trimmed to ``max_chars``."""
+    history = list(state.get("short_term_memory", [])) + list(exchanges)
+    chars = sum(len(exchange["message"]) for exchange in history)
+    start = 0
+    while chars > max_chars and len(history) - start > 1:
+        chars -= len(history[start]["message"])
+        start += 1
+    return dict(state, short_term_memory=history[start:])
+
+
+def clear_exchanges(state):
+    """Returns ``state`` with its short-term memory emptied.
+
+    ``clears`` counts the clears, so other workers know to empty their
+    recall indexes as well.
+    """
+    return dict(state, short_term_memory=[], clears=state.get("clears", 0) + 1)
+
+
+class SessionStore:
+    """Versioned session state shared by every worker process.
+
+    Backends implement ``load`` and ``compare_and_set``. Each user's state
+    carries a version number that increases on every write; ``update``
+    re-reads and re-applies its change whenever another worker wrote first,
+    so concurrent requests never overwrite each other.
+    """
+
+    max_attempts = 20
+
+    def __init__(self):
+        self.conflicts = 0
+
+    def load(self, user_id):
+        """Returns ``(state, version)``; a missing session is ``(None, 0)``."""
+        raise NotImplementedError
+
+    def load_for_update(self, user_id):
+        """Like ``load``, for a read that will be followed by ``compare_and_set``."""
+        return self.load(user_id)
+
+    def compare_and_set(self, user_id, state, expected_version):
+        """Stores ``state`` if the current version is ``expected_version``.
+
+        Returns the new version, or None if another writer got there first.
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def update(self, user_id, change):
+        """Applies ``change(state) -> state`` atomically; returns ``(state, version)``."""
+        for attempt in range(self.max_attempts):
+            state, version = self.load_for_update(user_id)
+            new_state = change(state or {})
+            new_version = self.compare_and_set(user_id, new_state, version)
+            if new_version is not None:
+                return new_state, new_version
+            self.conflicts += 1
+            time.sleep(min(0.05, 0.001 * 2 ** attempt))
+        raise SessionConflictError(f"Could not update session for {user_id} after {self.max_attempts} attempts")
+
+    def close(self):
+        """Releases any connections held by the store."""
+
+    def forget_connections(self):
+        """Drops connections inherited from a parent process, without closing them.
+
+        Closing would also shut the parent's copy of a socket, or release
+        its SQLite file locks, so a forked worker just opens new ones.
+        """
+        self._local = threading.local()
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by the workers on one host.
+
+    Point ``path`` at a tmpfs such as ``/dev/shm`` to keep the file in
+    shared memory. Sessions idle for longer than ``idle_ttl`` seconds are
+    treated as missing.
+    """
+
+    def __init__(self, path, idle_ttl=None, busy_timeout=5.0):
+        super().__init__()
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, user_id):
+        row = self._connection().execute(
+            "SELECT state, version, updated_at FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        state, version, updated_at = row
+        if self.idle_ttl and time.time() - updated_at > self.idle_ttl:
+            # Keep the version so a stale writer still conflicts.
+            return None, version
+        return json.loads(state), version
+
+    def compare_and_set(self, user_id, state, expected_version):
+        payload = json.dumps(state)
+        connection = self._connection()
+        if expected_version == 0:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO sessions (user_id, version, state, updated_at) VALUES (?, 1, ?, ?)",
+                (user_id, payload, time.time()),
+            )
+        else:
+            cursor = connection.execute(
+                "UPDATE sessions SET state = ?, version = version + 1, updated_at = ? "
+                "WHERE user_id = ? AND version = ?",
+                (payload, time.time(), user_id, expected_version),
+            )
+        return expected_version + 1 if cursor.rowcount == 1 else None
+
+    def delete(self, user_id):
+        self._connection().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class RedisConnection:
+    """Minimal RESP2 client: enough commands for optimistic transactions."""
+
+    def __init__(self, host, port, timeout=5.0, password=None, db=0):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    def execute(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Sessions in Redis, or anything that speaks its protocol.
+
+    Each session is one key holding ``{"version", "state"}``. Writes use
+    WATCH/MULTI/EXEC, so EXEC fails when another client changed the key
+    after it was read. Connections are per thread because WATCH state
+    belongs to the connection.
+    """
+
+    def __init__(self, url, idle_ttl=None, prefix="tone:session:"):
+        super().__init__()
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.idle_ttl = idle_ttl
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = RedisConnection(self.host, self.port, password=self.password, db=self.db)
+            self._local.connection = connection
+        return connection
+
+    def _call(self, *args, retry=True):
+        try:
+            return self._connection().execute(*args)
+        except (OSError, ConnectionError):
+            self._local.connection = None
+            if not retry:
+                raise
+            # Reconnect once. Commands after WATCH must not do this: a fresh
+            # connection has no WATCH, so its EXEC would skip the version check.
+            return self._connection().execute(*args)
+
+    def load(self, user_id):
+        return self._get(user_id)
+
+    def _get(self, user_id, retry=True):
+        raw = self._call("GET", self.prefix + user_id, retry=retry)
+        if raw is None:
+            return None, 0
+        record = json.loads(raw)
+        return record["state"], record["version"]
+
+    def load_for_update(self, user_id):
+        self._call("WATCH", self.prefix + user_id)
+        return self._get(user_id, retry=False)
+
+    def compare_and_set(self, user_id, state, expected_version):
+        key = self.prefix + user_id
+        payload = json.dumps({"version": expected_version + 1, "state": state})
+        try:
+            self._call("MULTI", retry=False)
+            if self.idle_ttl:
+                self._call("SET", key, payload, "EX", int(self.idle_ttl), retry=False)
+            else:
+                self._call("SET", key, payload, retry=False)
+        except (OSError, ConnectionError):
+            # Nothing is committed without EXEC; update() starts over from load_for_update.
+            return None
+        # If EXEC's reply is lost the write may or may not have happened, so that error is raised.
+        result = self._call("EXEC", retry=False)
+        return expected_version + 1 if result is not None else None
+
+    def delete(self, user_id):
+        self._call("DEL", self.prefix + user_id)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def create_session_store(config):
+    """Builds the shared session store selected by the app config.
+
+    Returns None for ``memory``, where sessions stay in the worker process.
+    """
+    kind = config.get("SESSION_STORE", "memory")
+    idle_ttl = config.get("SESSION_IDLE_TTL") or None
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteSessionStore(config["SESSION_STORE_PATH"], idle_ttl=idle_ttl)
+    if kind == "redis":
+        return RedisSessionStore(config["SESSION_STORE_URL"], idle_ttl=idle_ttl)
+    raise ValueError(f"Unknown SESSION_STORE: {kind!r}")
@@ -0,0 +1,152 @@
+const API_URL = 'http://127.0.0.1:5000';
+
+async function createProfile() {
+    const userId = document.getElementById('user_id').value;
+    const formality = document.getElementById('formality').value;
+    const enthusiasm = document.getElementById('enthusiasm').value;
+    const verbosity = document.getElementById('verbosity').value;
+    // --- NEW: Get values from new dropdowns ---
+    const persona = document.getElementById('persona').value;
+    const humor = document.getElementById('humor').value;
+    const profileStatus = document.getElementById('profile_status');
+
+    if (!userId) {
+        profileStatus.textContent = 'User ID cannot be empty.';
+        profileStatus.className = 'text-sm text-center text-red-500 mt-3';
+        return;
+    }
+
+    const profileData = {
+        user_id: userId,
+        preferences: {
+            // --- MODIFIED: Include new attributes in the payload ---
+            tone_preferences: { formality, enthusiasm, verbosity, persona, humor },
+            communication_style: { technical_level: "intermediate" }
+        }
+    };
+
+    try {
+        const response = await fetch(`${API_URL}/api/profile`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(profileData)
+        });
+        const result = await response.json();
+        profileStatus.textContent = result.message;
+        profileStatus.className = 'text-sm text-center text-green-500 mt-3';
+
+        document.getElementById('message_input').disabled = false;
+        document.getElementById('send_button').disabled = false;
+        document.getElementById('welcome_message_container').innerHTML = '<p class="text-gray-500">You can now chat with the AI.</p>';
+    } catch (error) {
+        profileStatus.textContent = 'Error creating profile.';
+        profileStatus.className = 'text-sm text-center text-red-500 mt-3';
+        console.error('Profile creation error:', error);
+    }
+}
+
+async function sendMessage() {
+    const userId = document.getElementById('user_id').value;
+    const messageInput = document.getElementById('message_input');
+    const message = messageInput.value.trim();
+
+    if (!message || !userId) return;
+
+    const welcomeMsg = document.getElementById('welcome_message_container');
+    if (welcomeMsg) welcomeMsg.remove();
+
+    addMessageToChat('user', message);
+    messageInput.value = '';
+    addMessageToChat('ai', '...', 'thinking-bubble'); // Typing indicator
+
+    try {
+        const response = await fetch(`${API_URL}/api/chat/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, message: message, context: 'personal' })
+        });
+
+        if (!response.ok) {
+            const thinkingBubble = document.getElementById('thinking-bubble');
+            if (thinkingBubble) thinkingBubble.remove();
+            const result = await response.json();
+            addMessageToChat('ai', `Error: ${result.error}`);
+            return;
+        }
+
+        // --- NEW: Render the reply progressively as server-sent events arrive ---
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let bubble = null;
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const rawEvent of events) {
+                let eventName = 'message';
+                let data = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                const payload = data ? JSON.parse(data) : {};
+                if (eventName === 'token') {
+                    if (!bubble) {
+                        bubble = document.getElementById('thinking-bubble');
+                        bubble.classList.remove('animate-pulse');
+                        bubble.removeAttribute('id');
+                        bubble.textContent = '';
+                    }
+                    bubble.textContent += payload.text;
+                    const chatWindow = document.getElementById('chat_window');
+                    chatWindow.scrollTop = chatWindow.scrollHeight;
+                } else if (eventName === 'error') {
+                    const thinkingBubble = document.getElementById('thinking-bubble');
+                    if (thinkingBubble) thinkingBubble.remove();
+                    addMessageToChat('ai', `Error: ${payload.error}`);
+                } else if (eventName === 'done') {
+                    // An empty reply sends no tokens, so the indicator is still showing.
+                    const thinkingBubble = document.getElementById('thinking-bubble');
+                    if (thinkingBubble) thinkingBubble.remove();
+                }
+            }
+        }
+        // The stream may also end without a 'done' event.
+        const thinkingBubble = document.getElementById('thinking-bubble');
+        if (thinkingBubble) thinkingBubble.remove();
+    } catch (error) {
+        const thinkingBubble = document.getElementById('thinking-bubble');
+        if (thinkingBubble) thinkingBubble.remove();
+        addMessageToChat('ai', 'An unexpected network error occurred.');
+        console.error('Chat error:', error);
+    }
+}
+
+function addMessageToChat(role, text, id = null) {
+    const chatWindow = document.getElementById('chat_window');
+    const bubbleWrapper = document.createElement('div');
+    const alignment = role === 'user' ? 'justify-end' : 'justify-start';
+    const bubbleClasses = role === 'user' ? 'user' : 'ai';
+
+    const wrapperDiv = document.createElement('div');
+    wrapperDiv.className = `flex w-full ${alignment}`;
+
+    bubbleWrapper.className = `chat-bubble ${bubbleClasses}`;
+    if (id) bubbleWrapper.id = id;
+    if (text === '...') bubbleWrapper.classList.add('animate-pulse');
+
+    bubbleWrapper.textContent = text;
+
+    wrapperDiv.appendChild(bubbleWrapper);
+    chatWindow.appendChild(wrapperDiv);
+    chatWindow.scrollTop = chatWindow.scrollHeight;
+}
+
+document.getElementById('message_input').addEventListener('keypress', function (e) {
+    if (e.key === 'Enter') {
+        sendMessage();
+    }
+});
@@ -0,0 +1,114 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from database import db
+
+# Sessions for read-only endpoints; bound to the read engine by init_storage.
+read_session = scoped_session(sessionmaker())
+
+
+def _is_file_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def _sqlite_pragmas(config, read_only=False):
+    """Returns the PRAGMA statements run on every new SQLite connection."""
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+        "PRAGMA foreign_keys = ON",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        # WAL lets readers proceed while a writer commits; the mode is stored in
+        # the database file, so read-only connections pick it up as well.
+        pragmas.insert(0, f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+    return pragmas
+
+
+def _install_pragmas(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def engine_options(uri, config):
+    """Builds SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    File-backed SQLite gets a thread-safe connection pool and a larger
+    statement cache so prepared statements are reused across requests.
+    Server databases get a pool with pre-ping. In-memory SQLite keeps
+    SQLAlchemy's default single-connection pool, which takes no sizing
+    options.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and not _is_file_sqlite(url):
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if _is_file_sqlite(url):
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0,
+            'cached_statements': config['SQLITE_CACHED_STATEMENTS'],
+        }
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+
+def _read_only_uri(uri, project_dir):
+    """Returns a URI that opens the same SQLite file in read-only mode."""
+    url = make_url(uri)
+    database = url.database
+    if not database.startswith('/'):
+        database = f"{project_dir}/{database}"
+    return f"sqlite:///file:{database}?mode=ro&uri=true"
+
+
+def init_storage(app):
+    """Creates the engines and installs connection settings.
+
+    Must run after ``db.init_app(app)``. Read-only requests use
+    ``read_session``, which is bound to ``DATABASE_READ_URL`` when set and
+    otherwise to a read-only connection pool on the same SQLite file.
+    """
+    config = app.config
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        engine = db.get_engine()
+    url = make_url(uri)
+
+    if _is_file_sqlite(url):
+        _install_pragmas(engine, _sqlite_pragmas(config))
+
+    read_uri = config.get('DATABASE_READ_URL')
+    if read_uri:
+        read_engine = create_engine(read_uri, **engine_options(read_uri, config))
+    elif _is_file_sqlite(url):
+        read_engine = create_engine(
+            _read_only_uri(uri, app.root_path),
+            **engine_options(uri, config)
+        )
+        _install_pragmas(read_engine, _sqlite_pragmas(config, read_only=True))
+    else:
+        read_engine = engine
+    read_session.configure(bind=read_engine)
+
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        read_session.remove()
+
+    return engine, read_engine
@@ -0,0 +1,83 @@
+"""A local stand-in for an LLM completion service.
+
+Speaks the JSON protocol expected by ``llm_backends.HTTPBackend`` and can
+inject latency and errors, so the HTTP backend can be exercised without a
+real model:
+
+    python stub_llm_server.py --port 8089 --latency 0.2 --jitter 0.1 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import SimulatedBackend
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend = SimulatedBackend()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        server = self.server
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        if random.random() < server.error_rate:
+            self._send(503, {"error": "injected failure"})
+            return
+
+        text = self.backend.generate(request.get("prompt", ""), request.get("message", ""), request.get("tone", {}))
+        self._send(200, {"response": text})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up, e.g. a hedged request that lost the race.
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, quiet=True):
+    """Starts the stub server on a background thread and returns it.
+
+    Use ``server.server_address`` to find the bound port and
+    ``server.shutdown()`` to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.quiet = quiet
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503.")
+    args = parser.parse_args()
+
+    stub = start_stub_server(args.host, args.port, args.latency, args.jitter, args.error_rate, quiet=False)
+    print(f"Stub LLM server listening on http://{args.host}:{stub.server_address[1]}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
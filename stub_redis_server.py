@@ -0,0 +1,154 @@
+"""A local stand-in for Redis.
+
+Implements the subset of the Redis protocol used by
+``session_store.RedisSessionStore`` (PING, GET, SET with EX, DEL, WATCH,
+UNWATCH, MULTI, EXEC, DISCARD, AUTH, SELECT), so the shared session store
+can be exercised without a Redis server:
+
+    python stub_redis_server.py --port 6390
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class StubRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, StubRedisHandler)
+        self.lock = threading.Lock()
+        # key -> (value, expires_at or None)
+        self.data = {}
+        # key -> number of writes, compared by WATCH/EXEC
+        self.revisions = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.data[key]
+            self.revisions[key] = self.revisions.get(key, 0) + 1
+            return None
+        return value
+
+    def touch(self, key):
+        self.revisions[key] = self.revisions.get(key, 0) + 1
+
+
+class StubRedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.watched = {}
+        self.queued = None
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            try:
+                self.wfile.write(self._dispatch(command))
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _dispatch(self, command):
+        name = command[0].decode().upper()
+        args = command[1:]
+        if self.queued is not None and name not in ("EXEC", "DISCARD", "MULTI", "WATCH"):
+            self.queued.append((name, args))
+            return b"+QUEUED\r\n"
+        if name == "MULTI":
+            self.queued = []
+            return b"+OK\r\n"
+        if name == "DISCARD":
+            self.queued = None
+            self.watched = {}
+            return b"+OK\r\n"
+        if name == "WATCH":
+            with self.server.lock:
+                for key in args:
+                    self.server.get(key)
+                    self.watched[key] = self.server.revisions.get(key, 0)
+            return b"+OK\r\n"
+        if name == "EXEC":
+            return self._exec()
+        with self.server.lock:
+            return self._run(name, args)
+
+    def _exec(self):
+        queued, self.queued = self.queued or [], None
+        watched, self.watched = self.watched, {}
+        with self.server.lock:
+            for key, revision in watched.items():
+                self.server.get(key)
+                if self.server.revisions.get(key, 0) != revision:
+                    return b"*-1\r\n"
+            replies = [self._run(name, args) for name, args in queued]
+        return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+    def _run(self, name, args):
+        server = self.server
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("AUTH", "SELECT", "UNWATCH"):
+            if name == "UNWATCH":
+                self.watched = {}
+            return b"+OK\r\n"
+        if name == "GET":
+            value = server.get(args[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == "SET":
+            expires_at = None
+            if len(args) >= 4 and args[2].upper() == b"EX":
+                expires_at = time.monotonic() + int(args[3])
+            server.data[args[0]] = (args[1], expires_at)
+            server.touch(args[0])
+            return b"+OK\r\n"
+        if name == "DEL":
+            removed = 0
+            for key in args:
+                if server.data.pop(key, None) is not None:
+                    removed += 1
+                server.touch(key)
+            return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+
+def start_stub_redis(host="127.0.0.1", port=0):
+    """Starts the stand-in on a background thread and returns it.
+
+    Use ``server.server_address`` to find the bound port and
+    ``server.shutdown()`` to stop it.
+    """
+    server = StubRedisServer((host, port))
+    threading.Thread(target=server.serve_forever, name="stub-redis-server", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    stub = start_stub_redis(args.host, args.port)
+    print(f"Stub Redis server listening on redis://{args.host}:{stub.server_address[1]}/0")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -0,0 +1,86 @@
+"""Precomputed tone resolution.
+
+A user's resolved tone depends only on their tone preferences and the
+conversation context, so the compiler resolves every configured context
+for a given set of preferences once and caches the resulting table. A
+request then does a single dictionary lookup.
+
+Context rules can be extended with a JSON file (``TONE_RULES_FILE``)::
+
+    {"contexts": {"support": {"formality": "formal", "persona": "friendly", "humor": "none"}}}
+
+Each rule lists the tone settings that context overrides; contexts without
+a rule use the user's preferences unchanged.
+"""
+import json
+import os
+from functools import lru_cache
+
+DEFAULT_TONE = {
+    "formality": "balanced",
+    "enthusiasm": "medium",
+    "verbosity": "balanced",
+    "persona": "neutral",
+    "humor": "none",
+}
+
+DEFAULT_CONTEXT_RULES = {
+    "work": {"formality": "professional", "humor": "none", "persona": "professional"},
+    # For personal context, we rely on the user's baseline preferences for humor/persona.
+    "personal": {"formality": "casual"},
+}
+
+
+def load_tone_rules(path):
+    """Returns the context rules from a JSON rules file merged over the defaults."""
+    rules = {context: dict(overrides) for context, overrides in DEFAULT_CONTEXT_RULES.items()}
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as handle:
+            for context, overrides in json.load(handle).get("contexts", {}).items():
+                rules[context] = dict(overrides)
+    return rules
+
+
+class ToneCompiler:
+    """Caches, per set of tone preferences, the resolved tone of every context.
+
+    Resolved tones are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, rules=None, max_tables=4096):
+        self.rules = rules if rules is not None else load_tone_rules(None)
+        self._cached = lru_cache(maxsize=max_tables)(lambda items: self.compile(dict(items)))
+
+    def init_app(self, app):
+        """Loads the context rules named by ``TONE_RULES_FILE``."""
+        self.rules = load_tone_rules(app.config.get("TONE_RULES_FILE"))
+        self._cached.cache_clear()
+
+    def compile(self, preferences):
+        """Resolves every configured context for one set of preferences.
+
+        The table maps each context to its tone, and ``None`` to the
+        unmodified preferences used for contexts without a rule.
+        """
+        table = {None: dict(preferences)}
+        for context, overrides in self.rules.items():
+            table[context] = {**preferences, **overrides}
+        return table
+
+    def table_for(self, preferences):
+        """Returns the compiled table for ``preferences``, compiling it on first use."""
+        try:
+            return self._cached(tuple(preferences.items()))
+        except TypeError:
+            # Unhashable preference values cannot be cached; compile directly.
+            return self.compile(preferences)
+
+    def resolve(self, preferences, context):
+        """Returns the tone for ``context`` given a user's preferences."""
+        table = self.table_for(preferences)
+        tone = table.get(context)
+        return tone if tone is not None else table[None]
+
+
+# Shared compiler, configured with the app like the SQLAlchemy instance.
+tone_compiler = ToneCompiler()
@@ -1,101 +1,87 @@
-import random
-import json
+from llm_backends import SimulatedBackend
+from metrics import metrics
+from tone_compiler import DEFAULT_TONE, tone_compiler
+from trace_log import trace_log
+
+# Counter adjustments applied to interaction_history for each feedback type.
+FEEDBACK_DELTAS = {
+    "positive": {"feedback_score": 1, "successful_tone_matches": 1},
+    "negative": {"feedback_score": -1},
+}
 
 class ToneEngine:
     """Generates responses with an adaptive tone."""
 
-    def __init__(self, profile, memory_manager):
+    def __init__(self, profile, memory_manager, backend=None, compiler=None):
         self.profile = profile
         self.memory = memory_manager
+        self.backend = backend or SimulatedBackend()
+        self.compiler = compiler or tone_compiler
+        self.last_prompt_stats = None
 
     def _get_baseline_tone(self):
         """Gets the baseline tone from the user's profile."""
-        # --- MODIFIED: Added default persona and humor ---
-        return self.profile.get('tone_preferences', {
-            "formality": "balanced",
-            "enthusiasm": "medium",
-            "verbosity": "balanced",
-            "persona": "neutral",
-            "humor": "none"
-        })
+        return self.profile.get('tone_preferences', DEFAULT_TONE)
     
     def _analyze_context(self, context):
-        """Analyzes the conversation context to adjust the tone."""
-        adjusted_tone = self._get_baseline_tone()
-        # --- MODIFIED: Adjust persona and humor based on context ---
-        if context == 'work':
-            adjusted_tone['formality'] = 'professional'
-            adjusted_tone['humor'] = 'none'
-            adjusted_tone['persona'] = 'professional'
-        elif context == 'personal':
-            adjusted_tone['formality'] = 'casual'
-            # For personal context, we rely on the user's baseline preferences for humor/persona
-        return adjusted_tone
+        """Returns the tone for the conversation context.
 
-    def generate_response(self, message, context):
-        """
-        Generates a response by creating a prompt for an LLM.
-        This is a simulation. In a real application, you would call an LLM API.
+        This is the precompiled tone, with any settings learned from the
+        user's feedback in this context applied on top. The result may be
+        shared between requests and must not be modified.
         """
-        tone = self._analyze_context(context)
-        
-        prompt = f"You are a helpful assistant. Your current user prefers the following tone: {json.dumps(tone)}. "
-        prompt += f"The conversation context is '{context}'. The user's technical level is '{self.profile.get('communication_style', {}).get('technical_level', 'intermediate')}'.\n\n"
-        
-        history = self.memory.get_conversation_history()
-        for exchange in history:
-            prompt += f"{exchange['role'].capitalize()}: {exchange['message']}\n"
-        
-        prompt += f"User: {message}\nAssistant:"
-        
-        print("--- GENERATED PROMPT ---")
-        print(prompt)
-        print("------------------------")
+        tone = self.compiler.resolve(self._get_baseline_tone(), context)
+        learned = self.memory.tone_patterns.get(context or "")
+        return {**tone, **learned} if learned else tone
 
-        simulated_response = self._get_simulated_llm_response(message, tone)
+    def _build_prompt(self, message, context):
+        """Builds the prompt for a message and returns it with the applied tone."""
+        with metrics.span("analyze_context"):
+            tone = self._analyze_context(context)
+        technical_level = self.profile.get('communication_style', {}).get('technical_level', 'intermediate')
 
-        return simulated_response, tone
+        with metrics.span("recall"):
+            recalled = self.memory.recall(message, context)
+        builder = self.memory.prompt_builder
+        with metrics.span("prompt_build"):
+            prompt = builder.build(self.memory, tone, context, technical_level, message, recalled)
+        self.last_prompt_stats = builder.last_stats
+        self.memory.last_applied = (context, tone)
+        metrics.observe_prompt(builder.last_stats["chars"])
+        trace_log.event(
+            "prompt", user_id=self.memory.user_id, context=context,
+            tone=tone, prompt=prompt, chars=builder.last_stats["chars"]
+        )
+        return prompt, tone
 
-    def _get_simulated_llm_response(self, message, tone):
-        """Simulates a response from an LLM based on the tone."""
-        responses = {
-            "casual": f"Hey there! So, about '{message}', you could probably just...",
-            "professional": f"Regarding your query about '{message}', the recommended course of action is...",
-            "formal": f"With respect to your inquiry, '{message}', it is advisable to proceed by..."
-        }
-        
-        base_response = responses.get(tone.get('formality', 'casual'), "I'm not sure how to answer that.")
+    def generate_response(self, message, context):
+        """
+        Generates a response by creating a prompt for the configured LLM backend.
+        The default backend is an offline simulation.
+        """
+        prompt, tone = self._build_prompt(message, context)
+        with metrics.span("generation"):
+            return self.backend.generate(prompt, message, tone), tone
 
-        if tone.get('enthusiasm') == 'high':
-            base_response += " It's going to be absolutely fantastic!"
-        if tone.get('verbosity') == 'detailed':
-            base_response += " To elaborate further, this involves several steps starting with..."
-        
-        # --- NEW: Add persona and humor to the response ---
-        personas = {
-            "witty": " You know, a clever person might say that...",
-            "friendly": " Just a friendly thought here, but...",
-            "professional": " From a professional standpoint, it's clear that..."
-        }
-        base_response += personas.get(tone.get('persona', 'neutral'), "")
+    def stream_response(self, message, context):
+        """Returns the applied tone and an iterator over response chunks."""
+        prompt, tone = self._build_prompt(message, context)
+        return self.backend.stream(prompt, message, tone), tone
 
-        if tone.get('humor') == 'punny':
-            puns = [" That's a *punny* way to put it!", " I'm not *kitten* you, that's the answer.", " That's some *egg-cellent* logic!"]
-            base_response += random.choice(puns)
-        
-        return base_response
+    async def agenerate_response(self, message, context):
+        """Async variant of generate_response for use from an event loop."""
+        prompt, tone = self._build_prompt(message, context)
+        with metrics.span("generation"):
+            return await self.backend.agenerate(prompt, message, tone), tone
 
     def process_feedback(self, feedback_type):
         """Adjusts user profile based on feedback."""
         history = self.profile.get('interaction_history', {})
-        score = history.get('feedback_score', 0)
+        for key, delta in FEEDBACK_DELTAS.get(feedback_type, {}).items():
+            history[key] = history.get(key, 0) + delta
 
-        if feedback_type == 'positive':
-            score += 1
-            history['successful_tone_matches'] = history.get('successful_tone_matches', 0) + 1
-        elif feedback_type == 'negative':
-            score -= 1
-        
-        history['feedback_score'] = score
         self.profile['interaction_history'] = history
-        print(f"Feedback processed. New score: {score}")
\ No newline at end of file
+        trace_log.event(
+            "feedback", user_id=self.profile.get('user_id'), feedback=feedback_type,
+            score=history.get('feedback_score', 0),
+        )
\ No newline at end of file
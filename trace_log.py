@@ -0,0 +1,236 @@
+"""Structured, sampled logging that stays off the request path.
+
+Request handlers call ``trace_log.event(kind, **fields)``, which only rolls
+the sampling dice and drops the record on a bounded queue. A background
+thread truncates oversized fields, redacts user text and writes one JSON
+line per record to the ``adaptive_tone`` logger. Optionally, it also
+appends the full, untruncated record to a gzip-compressed, rotating trace
+file for offline replay.
+
+    python trace_log.py traces/prompts.jsonl.gz   # print the captured prompts
+"""
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger("adaptive_tone")
+
+# Fields that carry user or model text.
+TEXT_FIELDS = ("prompt", "message", "response")
+
+
+def parse_sample_rates(spec):
+    """Parses ``"prompt=0.01,feedback=1"`` into a dict of rates."""
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            kind, rate = part.split("=", 1)
+            rates[kind.strip()] = float(rate)
+    return rates
+
+
+def redact_text(text):
+    """Replaces text with its length and a short digest."""
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+    return f"<redacted {len(text)} chars sha1:{digest}>"
+
+
+class RotatingTraceFile:
+    """Appends JSON lines to a gzip file and rotates it by size."""
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._handle = None
+        self._written = 0
+        self._rotations = 0
+
+    def write(self, line):
+        if self._handle is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._handle = gzip.open(self.path, "at", encoding="utf-8")
+            # A file reopened after a restart already holds data. Its compressed size is a cheap
+            # lower bound of the bytes written to it, so rotation no longer starts over from zero.
+            self._written = os.fstat(self._handle.fileno()).st_size
+        self._handle.write(line + "\n")
+        self._written += len(line) + 1
+        if self._written >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        directory, filename = os.path.split(self.path)
+        # Split the file name, not the path: directories may contain dots too.
+        stem, _, suffix = filename.partition(".")
+        base = os.path.join(directory, stem)
+        self._rotations += 1
+        os.replace(self.path, f"{base}-{time.strftime('%Y%m%d-%H%M%S')}-{self._rotations:04d}.{suffix}")
+        rotated = sorted(glob.glob(f"{glob.escape(base)}-*.{glob.escape(suffix)}"))
+        for old in rotated[:-self.backups] if self.backups else rotated:
+            os.remove(old)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.flush()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class TraceLog:
+    """Bounded, sampled, asynchronous event log."""
+
+    def __init__(self):
+        self.sample_rates = {}
+        self.default_rate = 1.0
+        self.redact = True
+        self.max_field_chars = 2000
+        self.trace_file = None
+        self.trace_kinds = ("prompt",)
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._exit_registered = False
+
+    def configure(self, config):
+        """Reads logging settings from an app config mapping.
+
+        Safe to call again while events are being written: the queue the
+        background thread drains is kept, only its size limit changes.
+        """
+        self.sample_rates = parse_sample_rates(config.get("LOG_SAMPLE_RATES"))
+        self.default_rate = float(config.get("LOG_DEFAULT_SAMPLE_RATE", 1.0))
+        self.redact = config.get("LOG_REDACT", True)
+        self.max_field_chars = int(config.get("LOG_MAX_FIELD_CHARS", self.max_field_chars))
+        with self._queue.mutex:
+            self._queue.maxsize = int(config.get("LOG_QUEUE_SIZE", 10000))
+        trace_file = None
+        if config.get("TRACE_FILE"):
+            trace_file = RotatingTraceFile(
+                config["TRACE_FILE"],
+                max_bytes=int(config.get("TRACE_FILE_MAX_BYTES", 64 * 1024 * 1024)),
+                backups=int(config.get("TRACE_FILE_BACKUPS", 5)),
+            )
+        with self._lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+            self.trace_file = trace_file
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        if not self._exit_registered:
+            atexit.register(self.shutdown)
+            self._exit_registered = True
+
+    def init_app(self, app):
+        self.configure(app.config)
+
+    def event(self, kind, **fields):
+        """Queues a record if it is sampled; never blocks the caller."""
+        rate = self.sample_rates.get(kind, self.default_rate)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        try:
+            self._queue.put_nowait((time.time(), kind, fields))
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._start()
+
+    def flush(self, timeout=5.0):
+        """Waits until every queued record has been written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self.trace_file is not None:
+            with self._lock:
+                self.trace_file.flush()
+
+    def shutdown(self):
+        self.flush()
+        if self.trace_file is not None:
+            with self._lock:
+                self.trace_file.close()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._drain, name="trace-log", daemon=True)
+                self._thread.start()
+
+    def _drain(self):
+        while True:
+            timestamp, kind, fields = self._queue.get()
+            try:
+                self._write(timestamp, kind, fields)
+            except Exception:
+                logger.exception("Trace log write failed")
+            finally:
+                self._queue.task_done()
+
+    def _cap(self, value):
+        if isinstance(value, str) and len(value) > self.max_field_chars:
+            return value[:self.max_field_chars] + f"...<{len(value) - self.max_field_chars} more chars>"
+        return value
+
+    def _write(self, timestamp, kind, fields):
+        record = {"ts": timestamp, "event": kind, **fields}
+        if self.trace_file is not None and kind in self.trace_kinds:
+            # The trace is for replay, so it keeps every field whole.
+            with self._lock:
+                # configure() may have closed the file since the check above.
+                if self.trace_file is not None:
+                    self.trace_file.write(json.dumps(record, default=str))
+
+        record = {key: self._cap(value) for key, value in record.items()}
+        if self.redact:
+            for key in TEXT_FIELDS:
+                if isinstance(fields.get(key), str):
+                    record[key] = redact_text(fields[key])
+        logger.info(json.dumps(record, default=str))
+        self.written += 1
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+
+def iter_trace_records(path):
+    """Yields the records stored in a trace file."""
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# Shared logger, configured with the app like the SQLAlchemy instance.
+trace_log = TraceLog()
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        for record in iter_trace_records(path):
+            if record.get("event") == "prompt":
+                print(f"--- {record.get('user_id')} ({record.get('context')}) ---")
+                print(record.get("prompt"))